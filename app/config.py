@@ -6,5 +6,103 @@ class Config:
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     MODEL_PATH = "cointegrated/rubert-tiny-toxicity"
+    # Микробатчинг инференса: максимум текстов в батче, окно ожидания (мс) и число потоков.
+    NLP_BATCH_MAX_SIZE = int(os.getenv("NLP_BATCH_MAX_SIZE", "16"))
+    NLP_BATCH_MAX_WAIT_MS = float(os.getenv("NLP_BATCH_MAX_WAIT_MS", "10"))
+    NLP_INFERENCE_THREADS = int(os.getenv("NLP_INFERENCE_THREADS", "1"))
+    # Кэш вердиктов: размер и TTL (сек) локального LRU, TTL (сек) записей в Redis.
+    VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))
+    VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "600"))
+    VERDICT_CACHE_REDIS_TTL = int(os.getenv("VERDICT_CACHE_REDIS_TTL", "86400"))
+    # Append-only журнал обучающих данных (SQLite WAL) и параметры фонового писателя.
+    TRAINING_DB_PATH = os.getenv("TRAINING_DB_PATH", "training_data.db")
+    TRAINING_LOG_BATCH_SIZE = int(os.getenv("TRAINING_LOG_BATCH_SIZE", "256"))
+    TRAINING_LOG_FLUSH_INTERVAL = float(os.getenv("TRAINING_LOG_FLUSH_INTERVAL", "1.0"))
+    # Предел очереди фонового писателя журнала; сверх него записи отбрасываются (например, пока журнал не открывается).
+    TRAINING_LOG_MAX_QUEUE = int(os.getenv("TRAINING_LOG_MAX_QUEUE", "10000"))
+    # Бэкенд инференса: torch (fp32), torch-int8 (динамическая квантизация) или onnx (ONNX Runtime).
+    NLP_BACKEND = os.getenv("NLP_BACKEND", "torch")
+    ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "app/models/onnx")
+    # Потоки внутри одного forward pass (0 – значение рантайма по умолчанию).
+    NLP_INTRA_OP_THREADS = int(os.getenv("NLP_INTRA_OP_THREADS", "0"))
+    # Период проверки manifest.json дообученной модели (сек); 0 – без автоматической перезагрузки.
+    MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "60"))
+    # Токен для административных HTTP-эндпоинтов (заголовок X-Admin-Token); пустой – эндпоинты выключены.
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    # Каскад предварительной фильтрации перед трансформером (app/core/prefilter.py).
+    PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "1") == "1"
+    PREFILTER_MODEL_PATH = os.getenv("PREFILTER_MODEL_PATH", "app/models/prefilter.npz")
+    PREFILTER_LEXICON_FILE = os.getenv("PREFILTER_LEXICON_FILE", "")
+    # Сообщения с оценкой линейной модели ниже порога не идут в трансформер (выше порог – больше пропусков, ниже recall).
+    PREFILTER_CLEAR_THRESHOLD = float(os.getenv("PREFILTER_CLEAR_THRESHOLD", "0.2"))
+    # Сообщения, где букв не больше этого числа (ссылки, эмодзи, «ок»), считаются безобидными.
+    PREFILTER_SHORT_CHARS = int(os.getenv("PREFILTER_SHORT_CHARS", "3"))
+    # Более длинные тексты линейная модель не очищает.
+    PREFILTER_MAX_CHARS = int(os.getenv("PREFILTER_MAX_CHARS", "300"))
+    # Хранилище состояния модерации: memory (в процессе) или redis (общее для воркеров и узлов).
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+    # Время (сек), в течение которого ждем ответа на тест; неотвеченные тесты удаляются.
+    PENDING_TEST_TTL = float(os.getenv("PENDING_TEST_TTL", "600"))
+    # Прием обновлений: polling (только один процесс) или webhook (через FastAPI, любое число воркеров).
+    # Для webhook обязателен WEBHOOK_SECRET; несколько воркеров требуют STATE_BACKEND=redis
+    # и PROMETHEUS_MULTIPROC_DIR (иначе каждый воркер отдает в /metrics только свои счетчики).
+    TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+    # Число воркеров gunicorn (gunicorn читает ту же переменную).
+    WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+    PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Публичный адрес сервиса, например https://bot.example.com
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    # Окно (сек), в течение которого повторная доставка того же update_id отбрасывается.
+    UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "600"))
+    # Внешний корпус скороговорок для теста (по одной в строке); пусто – встроенный список.
+    TONGUE_TWISTERS_FILE = os.getenv("TONGUE_TWISTERS_FILE", "")
+    # Голосовые сообщения: лимиты до скачивания, процессы декодирования, размер куска для STT (сек).
+    VOICE_MAX_DURATION = float(os.getenv("VOICE_MAX_DURATION", "120"))
+    VOICE_MAX_BYTES = int(os.getenv("VOICE_MAX_BYTES", "1048576"))
+    VOICE_DECODE_PROCESSES = int(os.getenv("VOICE_DECODE_PROCESSES", "1"))
+    VOICE_CHUNK_SECONDS = float(os.getenv("VOICE_CHUNK_SECONDS", "1.0"))
+    # Локальный движок распознавания речи (vosk или none) и путь к его модели.
+    STT_ENGINE = os.getenv("STT_ENGINE", "vosk")
+    STT_MODEL_PATH = os.getenv("STT_MODEL_PATH", "app/models/vosk-model-small-ru")
+    STT_THREADS = int(os.getenv("STT_THREADS", "1"))
+    # Кэш типа чата и статуса участников для мута: локальный TTL (сек), TTL в Redis (сек), размер.
+    CHAT_INFO_TTL = float(os.getenv("CHAT_INFO_TTL", "60"))
+    CHAT_INFO_REDIS_TTL = int(os.getenv("CHAT_INFO_REDIS_TTL", "3600"))
+    CHAT_INFO_CACHE_SIZE = int(os.getenv("CHAT_INFO_CACHE_SIZE", "10000"))
+    # Исходящие вызовы Telegram: лимиты (сообщений в секунду) на бота и на чат, запас на чат, повторы после 429.
+    OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+    OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "0.33"))
+    OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+    OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+    # Сколько обновлений обрабатывается одновременно (1 – строго последовательно, как раньше).
+    # Обновления одного пользователя в одном чате всегда идут по порядку.
+    UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+    # Длинные сообщения режутся на окна по NLP_WINDOW_TOKENS токенов с перекрытием NLP_WINDOW_STRIDE;
+    # окон не больше NLP_MAX_WINDOWS (остаток текста не проверяется).
+    NLP_WINDOW_TOKENS = int(os.getenv("NLP_WINDOW_TOKENS", "512"))
+    NLP_WINDOW_STRIDE = int(os.getenv("NLP_WINDOW_STRIDE", "64"))
+    NLP_MAX_WINDOWS = int(os.getenv("NLP_MAX_WINDOWS", "8"))
+    # Стадия допуска: сообщения старше UPDATE_MAX_AGE сек не анализируются (0 – без ограничения).
+    UPDATE_MAX_AGE = float(os.getenv("UPDATE_MAX_AGE", "120"))
+    # При очереди обновлений от ADMISSION_HIGH_WATER (0 – никогда) бот переходит в деградированный режим:
+    # в модель идут совпадения со словарем и лишь доля ADMISSION_DEGRADED_SAMPLE остальных сообщений.
+    ADMISSION_HIGH_WATER = int(os.getenv("ADMISSION_HIGH_WATER", "200"))
+    ADMISSION_DEGRADED_SAMPLE = float(os.getenv("ADMISSION_DEGRADED_SAMPLE", "0.1"))
+    # Диагностические эндпоинты /admin/profile, /admin/tasks, /admin/timings (нужен и ADMIN_TOKEN).
+    # Выключенными ничего не стоят: поэтапные времена сообщений пишутся только при PROFILING_ENABLED=1.
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+    PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "200"))
+    # Общий сервер инференса (python -m app.services.inference_server): путь к его Unix-сокету.
+    # Пусто – каждый воркер загружает модель сам. Недоступен сервер – воркер переходит на свою модель.
+    INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+    INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "5"))
+    # После стольких таймаутов или ошибок сервера подряд воркер отключается от него и переходит на свою модель.
+    INFERENCE_MAX_FAILURES = int(os.getenv("INFERENCE_MAX_FAILURES", "3"))
+    # Сколько секунд воркер при старте ждет сервер (он может еще загружать модель), прежде чем загрузить свою.
+    INFERENCE_CONNECT_WAIT = float(os.getenv("INFERENCE_CONNECT_WAIT", "60"))
+    # Ядра, к которым привязывается сервер инференса (например, "0-3" или "0,2"); пусто – без привязки.
+    INFERENCE_SERVER_CPUS = os.getenv("INFERENCE_SERVER_CPUS", "")
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,94 @@
+# расположен в: police-bot-prod/app/core/admission.py
+
+import datetime
+import random
+
+from app.config import Config
+from app.core.prefilter import normalize
+from app.services import metrics
+
+
+class Admission:
+    """
+    Стадия допуска перед обработчиками сообщений: решает, стоит ли вообще анализировать обновление,
+    пока бот разбирает всплеск (рейд, накопленный за время рестарта polling).
+      - устаревшие сообщения (старше UPDATE_MAX_AGE) не анализируются;
+      - сообщения из чатов с активным кулдауном отбрасываются до токенизации – предупреждение
+        там все равно не будет выдано;
+      - при очереди обновлений выше ADMISSION_HIGH_WATER включается деградированный режим
+        (считаются и ждущие очереди по ключу, и еще не взятые PTB из application.update_queue –
+        именно там копится отставание, когда заняты все слоты concurrent_updates):
+        голосовые не распознаются, а в модель идут только совпадения со словарем каскада
+        и случайная доля остальных сообщений. Режим выключается, когда очередь падает вдвое.
+    Ответы на ожидающий тест допускаются всегда. Каждое решение считается в /metrics.
+    """
+
+    def __init__(self, state, updates, prefilter=None, max_age: float = None, high_water: int = None,
+                 degraded_sample: float = None):
+        self.state = state
+        self.updates = updates
+        self.prefilter = prefilter
+        self.max_age = max_age if max_age is not None else Config.UPDATE_MAX_AGE
+        self.high_water = high_water if high_water is not None else Config.ADMISSION_HIGH_WATER
+        self.degraded_sample = degraded_sample if degraded_sample is not None else Config.ADMISSION_DEGRADED_SAMPLE
+        self._degraded = False
+        # application.update_queue; задается в PoliceBot.create_app.
+        self.update_queue = None
+
+    def depth(self) -> int:
+        backlog = self.update_queue.qsize() if self.update_queue is not None else 0
+        return self.updates.queued() + backlog
+
+    @property
+    def degraded(self) -> bool:
+        if self.high_water <= 0:
+            return False
+        queued = self.depth()
+        if queued >= self.high_water:
+            self._degraded = True
+        elif queued < self.high_water // 2:
+            self._degraded = False
+        return self._degraded
+
+    def is_stale(self, message) -> bool:
+        if self.max_age <= 0 or message.date is None:
+            return False
+        age = datetime.datetime.now(datetime.timezone.utc) - message.date
+        return age.total_seconds() > self.max_age
+
+    async def admit(self, update) -> bool:
+        """
+        True, если обновление нужно обработать. Вызывается уже в очереди по ключу (chat_id, user_id):
+        решение ждет хранилище состояния, и сообщения пользователя не должны обгонять друг друга.
+        """
+        message = update.effective_message
+        chat = update.effective_chat
+        user = update.effective_user
+        if not message or not chat or not user:
+            return True
+        if self.is_stale(message):
+            shed = metrics.SHED_STALE
+        elif await self.state.is_chat_cooling_down(chat.id):
+            shed = metrics.SHED_COOLDOWN
+        elif message.voice and self.degraded:
+            shed = metrics.SHED_VOICE
+        else:
+            metrics.ADMITTED.inc()
+            return True
+        if await self.state.get_pending_test(chat.id, user.id) is not None:
+            metrics.ADMITTED.inc()
+            return True
+        shed.inc()
+        return False
+
+    def should_score(self, text: str) -> bool:
+        """
+        В деградированном режиме решает, пойдет ли текст в модель: словарь – всегда, остальное – выборочно.
+        """
+        if self.prefilter is not None and self.prefilter.lexicon.search(normalize(text)):
+            return True
+        if random.random() < self.degraded_sample:
+            metrics.DEGRADED_SAMPLED.inc()
+            return True
+        metrics.DEGRADED_SKIPPED.inc()
+        return False
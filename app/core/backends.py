@@ -0,0 +1,100 @@
+"""
+Inference backends for the toxicity classifier.
+All backends expose the same interface: `tensor_type` tells the tokenizer which tensors
+to return, and `scores(inputs)` returns the sigmoid toxicity score (logit 0) per row.
+    - "torch":      the original fp32 PyTorch model.
+    - "torch-int8": PyTorch with dynamic int8 quantization of the Linear layers.
+    - "onnx":       an ONNX Runtime graph produced by `python -m app.services.export_model`.
+torch, transformers and onnxruntime are imported lazily, on first model load, so that importing
+the bot (and starting the HTTP server) does not pay for them.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class TorchBackend:
+    tensor_type = "pt"
+
+    def __init__(self, model, name="torch"):
+        import torch
+        self._torch = torch
+        self.model = model
+        self.name = name
+
+    def scores(self, inputs):
+        torch = self._torch
+        with torch.no_grad():
+            outputs = self.model(**inputs, return_dict=True)
+        return torch.sigmoid(outputs.logits)[:, 0].tolist()
+
+
+class OnnxBackend:
+    tensor_type = "np"
+    name = "onnx"
+
+    def __init__(self, session):
+        self.session = session
+        self.input_names = {i.name for i in session.get_inputs()}
+
+    def scores(self, inputs):
+        feed = {key: value.astype(np.int64) for key, value in inputs.items() if key in self.input_names}
+        logits = self.session.run(["logits"], feed)[0]
+        return (1.0 / (1.0 + np.exp(-logits[:, 0]))).tolist()
+
+
+def onnx_model_path(source: str) -> str:
+    # Both hub ids and local directories map to a flat directory name under ONNX_MODEL_DIR.
+    name = source.strip("/").replace("/", "__")
+    return os.path.join(Config.ONNX_MODEL_DIR, name, "model.onnx")
+
+
+def load_torch_model(source: str):
+    from transformers import AutoModelForSequenceClassification
+    model = AutoModelForSequenceClassification.from_pretrained(source)
+    model.eval()
+    return model
+
+
+def load_backend(kind: str, source: str):
+    """
+    Load the tokenizer and the requested backend for a model source (hub id or local directory).
+    Falls back to fp32 PyTorch if the ONNX graph or onnxruntime is not available.
+    """
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown NLP backend {kind!r}, expected one of {BACKENDS}")
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(source)
+
+    if kind == "onnx":
+        path = onnx_model_path(source)
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            logger.error("onnxruntime is not installed; falling back to the torch backend.")
+        else:
+            if os.path.exists(path):
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = Config.NLP_INTRA_OP_THREADS
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+                return OnnxBackend(session), tokenizer
+            logger.error(f"ONNX graph {path} not found (run app.services.export_model); falling back to torch.")
+        return TorchBackend(load_torch_model(source)), tokenizer
+
+    import torch
+    if Config.NLP_INTRA_OP_THREADS > 0:
+        torch.set_num_threads(Config.NLP_INTRA_OP_THREADS)
+    model = load_torch_model(source)
+    if kind == "torch-int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return TorchBackend(model, name="torch-int8"), tokenizer
+    return TorchBackend(model), tokenizer
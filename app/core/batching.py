@@ -0,0 +1,107 @@
+"""
+Asynchronous micro-batching for model inference.
+Callers await `MicroBatcher.submit(item)`; a background worker collects up to
+`max_batch_size` items or waits at most `max_wait_ms` after the first one arrives,
+then runs the synchronous batch function in a thread pool so that the event loop
+keeps serving other updates while the model is busy.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=10.0, threads=1):
+        # batch_fn takes a list of items and returns a list of results in the same order.
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.threads = max(1, int(threads))
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="nlp-infer")
+        self._pending = deque()
+        self._inflight = set()
+        self._worker = None
+        self._nonempty = None
+        self._full = None
+        self._slots = None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        # Primitives are created lazily so they bind to the loop that actually runs the bot.
+        self._nonempty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.threads)
+        if self._pending:
+            self._nonempty.set()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._nonempty.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._nonempty.wait()
+            # The wait window starts with the first queued item; a full batch cuts it short.
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            size = min(len(self._pending), self.max_batch_size)
+            batch = [self._pending.popleft() for _ in range(size)]
+            if not self._pending:
+                self._nonempty.clear()
+            # Callers that gave up (e.g. handler cancelled) are not worth a forward pass.
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            await self._slots.acquire()
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch) -> None:
+        loop = asyncio.get_running_loop()
+        items = [item for item, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as ex:
+            logger.error(f"Inference batch of {len(items)} failed: {ex}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.cancel()
+        self.executor.shutdown(wait=False)
@@ -1,30 +1,45 @@
 import datetime
+import functools
 import random
-import difflib
 import logging
+from contextlib import aclosing
 from telegram.ext import (
     Application,
     MessageHandler,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     filters,
 )
 from telegram import Update, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
-from app.core.nlp import NLPProcessor
+from telegram.error import TelegramError
+from app.core.admission import Admission
+from app.core.nlp import ModelUnavailable, NLPProcessor, Verdict
 from app.core.learning import log_flagged_message, log_feedback
+from app.core.matching import AnswerMatcher, load_tongue_twisters
+from app.core.prefilter import Prefilter
+from app.core.serial_executor import KeyedSerialExecutor
+from app.core.state import create_state_store
+from app.services import metrics, profiling
+from app.services.chat_info import ChatInfoCache
+from app.services.outbound import PRIORITY_MUTE, PRIORITY_REPLY, PRIORITY_WARNING, OutboundScheduler
+from app.services.verdict_cache import CachedVerdict, VerdictCache
+from app.services.voice import VoicePipeline
 from app.config import Config
 
 logger = logging.getLogger(__name__)
 
-# Список скороговорок для прохождения теста на трезвость.
-TONGUE_TWISTERS = [
+# Встроенный список скороговорок для прохождения теста на трезвость.
+DEFAULT_TONGUE_TWISTERS = [
     "Карл у Клары украл кораллы, а Клара у Карла украла кларнет",
     "Шла Саша по шоссе и сосала сушку",
     "От топота копыт пыль по полю летит",
     "Как утром, так и вечером – все повторится снова",
     "На дворе трава, на траве дрова"
 ]
+# Внешний корпус (Config.TONGUE_TWISTERS_FILE) заменяет встроенный список.
+TONGUE_TWISTERS = load_tongue_twisters(Config.TONGUE_TWISTERS_FILE, DEFAULT_TONGUE_TWISTERS)
 
 COOLDOWN_SECONDS = 300  # Интервал между предупреждениями
 SIMILARITY_THRESHOLD = 0.8  # Минимальная схожесть ответа скороговорке
@@ -33,145 +48,360 @@ MUTE_TIME_SECONDS = 300     # Время мута (5 минут)
 class PoliceBot:
     def __init__(self):
         self.nlp = NLPProcessor()
-        # Отслеживаем время последнего предупреждения для каждого пользователя и в каждом чате.
-        self.last_warning = {}
-        self.last_chat_warning = {}
-        # Состояния ожидания теста: ключ – (chat_id, user_id), значение – dict с ожидаемой скороговоркой и временем выдачи.
-        self.pending_tests = {}
+        # Кулдауны предупреждений (по пользователю и по чату) и ожидающие тесты – с TTL,
+        # в памяти процесса или в Redis (общие для всех воркеров), см. Config.STATE_BACKEND.
+        self.state = create_state_store(COOLDOWN_SECONDS)
+        # Скороговорки нормализуются один раз при загрузке; проверка ответа – ограниченный Левенштейн.
+        self.matcher = AnswerMatcher(TONGUE_TWISTERS, SIMILARITY_THRESHOLD)
+        # Офлайн-распознавание голосовых: декодирование в пуле процессов, STT в своем пуле потоков.
+        self.voice = VoicePipeline()
+        # Кэш вердиктов модели: повторяющиеся тексты (копипаста, пересылки) не гоняются через трансформер.
+        self.verdicts = VerdictCache()
+        # Дешевый каскад перед моделью: очевидно безобидные сообщения не доходят до трансформера.
+        self.prefilter = Prefilter.from_config() if Config.PREFILTER_ENABLED else None
+        # Тип чата и статусы участников для мута – из кэша, а не двумя запросами к API на каждый мут.
+        self.chat_info = ChatInfoCache()
+        # Все исходящие сообщения и муты идут через очередь с лимитами Telegram и приоритетами.
+        self.outbound = OutboundScheduler()
+        # Параллельная обработка обновлений с сохранением порядка внутри (chat_id, user_id).
+        self.updates = KeyedSerialExecutor(max(Config.UPDATE_CONCURRENCY, 1))
+        # Отсев устаревших сообщений и сообщений из чатов на кулдауне, деградация при перегрузке.
+        self.admission = Admission(self.state, self.updates, self.prefilter)
 
     async def create_app(self) -> Application:
-        app = Application.builder().token(Config.TELEGRAM_TOKEN).build()
+        builder = Application.builder().token(Config.TELEGRAM_TOKEN)
+        if Config.UPDATE_CONCURRENCY > 1:
+            # PTB только ограничивает число одновременных обновлений; порядок по ключу и настоящий
+            # лимит держит self.updates. Слотов PTB с запасом: ждущие своей очереди тоже их занимают.
+            builder = builder.concurrent_updates(max(256, Config.UPDATE_CONCURRENCY * 4))
+        app = builder.build()
+        self.admission.update_queue = app.update_queue
         app.add_handler(CommandHandler("start", self.handle_start))
-        app.add_handler(MessageHandler(filters.VOICE, self.handle_voice))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        # Допуск внутри очереди по ключу: он ждет хранилище состояния (Redis), и следующее сообщение
+        # пользователя не должно обогнать предыдущее, пока решается его судьба.
+        app.add_handler(MessageHandler(filters.VOICE, self.serialized(self.admitted(self.handle_voice))))
+        app.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND, self.serialized(self.admitted(self.handle_text))
+        ))
         # Обработка callback query для скрытой обратной связи
-        app.add_handler(CallbackQueryHandler(self.handle_feedback_callback))
+        app.add_handler(CallbackQueryHandler(self.serialized(self.handle_feedback_callback)))
+        # Изменения состава и прав участников обновляют кэш метаданных чатов
+        app.add_handler(ChatMemberHandler(self.handle_chat_member, ChatMemberHandler.ANY_CHAT_MEMBER))
+        # Группа, ставшая супергруппой, получает новый chat_id: тип старого устарел
+        app.add_handler(MessageHandler(filters.StatusUpdate.MIGRATE, self.handle_migration))
+        app.add_error_handler(self.handle_error)
         return app
 
+    def serialized(self, handler):
+        """
+        Оборачивает хендлер так, что обновления одного пользователя в одном чате
+        выполняются по очереди, а разных – параллельно в пределах Config.UPDATE_CONCURRENCY.
+        """
+        async def run(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            chat = update.effective_chat
+            user = update.effective_user
+            key = (chat.id if chat else None, user.id if user else None)
+            if profiling.ENABLED:
+                await self.updates.run(key, profiling.traced, handler.__name__, handler, update, context)
+            else:
+                await self.updates.run(key, handler, update, context)
+        return run
+
+    def admitted(self, handler):
+        """
+        Пропускает к хендлеру только обновления, допущенные стадией допуска (см. app/core/admission.py).
+        """
+        @functools.wraps(handler)
+        async def run(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            if await self.admission.admit(update):
+                await handler(update, context)
+        return run
+
+    async def handle_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(context.error, TelegramError):
+            metrics.TELEGRAM_ERRORS.inc()
+        logger.error(f"Необработанная ошибка при обработке обновления: {context.error}")
+
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         message = update.effective_message
         if not message:
             return
-        await message.reply_text("Бот активен. Отправьте текст или голосовое сообщение для проверки.")
+        await self.outbound.call(
+            message.chat_id, PRIORITY_REPLY,
+            message.reply_text, "Бот активен. Отправьте текст или голосовое сообщение для проверки.",
+        )
 
-    async def transcribe_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    async def handle_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Обновление chat_member (или my_chat_member для самого бота): записываем новый статус участника
+        в кэш, чтобы решение о муте не опиралось на устаревшие права.
+        """
+        member_update = update.chat_member or update.my_chat_member
+        if not member_update:
+            return
+        chat = member_update.chat
+        new_member = member_update.new_chat_member
+        if update.my_chat_member and new_member.status in ("left", "kicked"):
+            # Бота удалили из чата: его метаданные больше не нужны и при возвращении будут запрошены заново.
+            await self.chat_info.invalidate_chat(chat.id)
+        else:
+            await self.chat_info.remember_chat(chat.id, chat.type)
+        await self.chat_info.remember_member(chat.id, new_member.user.id, new_member.status)
+
+    async def handle_migration(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Служебное сообщение о переходе группы в супергруппу (приходит и в старый, и в новый чат):
+        тип старого chat_id сбрасывается, новый сразу записывается как супергруппа.
         """
-        Заглушка для распознавания речи. Здесь можно реализовать интеграцию с сервисом Speech-to-Text.
+        message = update.effective_message
+        if not message:
+            return
+        if message.migrate_to_chat_id:
+            old_chat_id, new_chat_id = message.chat_id, message.migrate_to_chat_id
+        else:
+            old_chat_id, new_chat_id = message.migrate_from_chat_id, message.chat_id
+        await self.chat_info.invalidate_chat(old_chat_id)
+        await self.chat_info.remember_chat(new_chat_id, "supergroup")
+
+    async def iter_voice_transcript(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Асинхронно отдает накопленную транскрипцию голосового сообщения после каждого распознанного
+        фрагмента, так что анализ может начаться до конца распознавания.
+        Лимиты длительности и размера проверяются до скачивания файла.
         """
         message = update.effective_message
         if not message or not message.voice:
             logger.debug("Голосовое сообщение не найдено для транскрипции.")
-            return ""
+            return
+        if not self.voice.enabled:
+            logger.debug("Распознавание речи отключено.")
+            return
+        voice = message.voice
+        reason = self.voice.check_limits(voice)
+        if reason:
+            logger.info(f"Голосовое сообщение пропущено: {reason}.")
+            return
+        file = await context.bot.get_file(voice.file_id)
+        file_bytes = await file.download_as_bytearray()
+        pcm = await self.voice.decode(file_bytes)
+        parts = []
+        async for segment in self.voice.segments(pcm):
+            parts.append(segment)
+            yield " ".join(parts)
+
+    async def transcribe_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+        """
+        Полная транскрипция голосового сообщения (пустая строка, если распознать не удалось).
+        """
+        transcription = ""
         try:
-            voice = message.voice
-            file = await context.bot.get_file(voice.file_id)
-            file_bytes = await file.download_as_bytearray()
-            # Здесь можно вызвать сервис распознавания речи и вернуть транскрипцию.
-            transcription = "фактическая транскрипция голосового сообщения"
-            logger.info(f"Получена транскрипция: {transcription}")
-            return transcription
+            async for transcription in self.iter_voice_transcript(update, context):
+                pass
         except Exception as ex:
             logger.error(f"Ошибка при распознавании голосового сообщения: {ex}")
             return ""
+        if transcription:
+            logger.info(f"Получена транскрипция: {transcription}")
+        return transcription
+
+    async def analyze_text(self, text: str) -> Verdict:
+        """
+        Возвращает вердикт для текста: сначала каскад предфильтрации, затем кэш вердиктов, затем модель.
+        В деградированном режиме в модель идет только часть текстов, остальные считаются безобидными.
+        Пока модель не удалось загрузить, тексты не проверяются (а не ждут загрузки, занимая очередь).
+        Кэш проверяется до ожидания модели: пока она загружается, вердикты той версии, что загружается,
+        уже отдаются из кэша (в том числе посчитанные другими воркерами и сохраненные в Redis).
+        """
+        if self.prefilter is not None and self.prefilter.clears(text):
+            return Verdict(False, None, "prefilter")
+        model_version = self.nlp.cache_version
+        if model_version is not None:
+            cached = await self.verdicts.get(self.verdicts.make_key(text, model_version))
+            if cached is not None:
+                return Verdict(cached.needs_test, cached.score, model_version, cached.window)
+        try:
+            await self.nlp.wait_ready()
+        except ModelUnavailable as ex:
+            logger.debug(f"Сообщение пропущено без проверки: {ex}")
+            return Verdict(False, None, "unavailable")
+        if self.nlp.model_version != model_version:
+            # Загрузилась не та версия, под которой искали (например, бэкенд откатился на torch).
+            model_version = self.nlp.model_version
+            cached = await self.verdicts.get(self.verdicts.make_key(text, model_version))
+            if cached is not None:
+                return Verdict(cached.needs_test, cached.score, model_version, cached.window)
+        if self.admission.degraded and not self.admission.should_score(text):
+            return Verdict(False, None, "degraded")
+        try:
+            verdict = await self.nlp.predict(text)
+        except ModelUnavailable as ex:
+            logger.debug(f"Сообщение пропущено без проверки: {ex}")
+            return Verdict(False, None, "unavailable")
+        if verdict.score is None:
+            # Сервер инференса не ответил: сообщение не проверено, кэшировать нечего.
+            return verdict
+        # Модель могла смениться во время инференса – кэшируем под версией, которая реально отвечала.
+        await self.verdicts.set(
+            self.verdicts.make_key(text, verdict.model_version),
+            CachedVerdict(verdict.needs_test, verdict.score, verdict.window),
+        )
+        return verdict
 
     async def should_warn(self, user_id: int, chat_id: int) -> bool:
         """
         Проверяет, отправлялось ли для данного пользователя или чата предупреждение недавно.
         """
-        now = datetime.datetime.now()
-        user_warned = (user_id in self.last_warning and
-                       (now - self.last_warning[user_id]).total_seconds() < COOLDOWN_SECONDS)
-        chat_warned = (chat_id in self.last_chat_warning and
-                       (now - self.last_chat_warning[chat_id]).total_seconds() < COOLDOWN_SECONDS)
-        return not (user_warned or chat_warned)
+        return await self.state.should_warn(user_id, chat_id)
 
     async def update_warning_timestamps(self, user_id: int, chat_id: int) -> None:
-        now = datetime.datetime.now()
-        self.last_warning[user_id] = now
-        self.last_chat_warning[chat_id] = now
+        await self.state.mark_warned(user_id, chat_id)
 
-    def build_feedback_keyboard(self, chat_id: int, user_id: int) -> InlineKeyboardMarkup:
+    def build_feedback_keyboard(self, flag_id: str) -> InlineKeyboardMarkup:
         """
         Создает inline-клавиатуру для скрытой обратной связи:
         lhs: 👍 (лайк), rhs: 👎 (дизлайк).
-        Callback data содержит тип обратной связи, chat_id и user_id.
+        Callback data содержит тип обратной связи и flag_id срабатывания.
         """
         keyboard = [
             [
-                InlineKeyboardButton("👍", callback_data=f"like|{chat_id}|{user_id}"),
-                InlineKeyboardButton("👎", callback_data=f"dislike|{chat_id}|{user_id}")
+                InlineKeyboardButton("👍", callback_data=f"like|{flag_id}"),
+                InlineKeyboardButton("👎", callback_data=f"dislike|{flag_id}")
             ]
         ]
         return InlineKeyboardMarkup(keyboard)
     
-    async def issue_test(self, chat_id: int, user_id: int, message, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def issue_test(self, chat_id: int, user_id: int, flag_id: str, message,
+                         context: ContextTypes.DEFAULT_TYPE) -> None:
         """
         Выдает тест на трезвость с выбранной случайной скороговоркой и прикрепляет inline-клавиатуру для обратной связи.
-        Сохраняет состояние теста для последующей проверки ответа.
+        Сохраняет состояние теста для последующей проверки ответа; кулдаун выставляет вызывающий код.
         """
         tongue_twister = random.choice(TONGUE_TWISTERS)
-        self.pending_tests[(chat_id, user_id)] = {
-            "expected": tongue_twister,
-            "timestamp": datetime.datetime.now()
-        }
+        await self.state.set_pending_test(chat_id, user_id, tongue_twister)
         response = (
             f"Ваше сообщение вызывает подозрение. Пожалуйста, пройдите тест на трезвость:\n\n"
             f"произнесите скороговорку: '{tongue_twister}'"
         )
-        await self.update_warning_timestamps(user_id, chat_id)
         try:
-            await message.reply_text(response, reply_markup=self.build_feedback_keyboard(chat_id, user_id))
-        except Exception as e:
+            await self.outbound.call(
+                chat_id, PRIORITY_WARNING,
+                message.reply_text, response, reply_markup=self.build_feedback_keyboard(flag_id),
+            )
+        except TelegramError as e:
+            metrics.TELEGRAM_ERRORS.inc()
             logger.error(f"Ошибка при отправке предупреждения: {e}")
+        except Exception as e:
+            # Не ошибка Telegram API (например, баг): в счетчик ошибок Telegram не попадает.
+            logger.exception(f"Непредвиденная ошибка при отправке предупреждения: {e}")
+
+    async def check_test_answer(self, chat_id: int, user_id: int, answer: str, expected: str, message,
+                                context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Проверяет ответ на тест (текстом или транскрипцией голоса): при достаточной схожести
+        со скороговоркой тест пройден, иначе пользователь получает мут.
+        """
+        if self.matcher.matches(answer, expected):
+            metrics.TESTS_PASSED.inc()
+            try:
+                await self.outbound.call(
+                    chat_id, PRIORITY_REPLY, message.reply_text, "Тест успешно пройден. Вы выглядите трезвыми!"
+                )
+            except TelegramError as e:
+                metrics.TELEGRAM_ERRORS.inc()
+                logger.error(f"Ошибка при отправке подтверждения: {e}")
+            except Exception as e:
+                    logger.exception(f"Непредвиденная ошибка при отправке подтверждения: {e}")
+        else:
+            metrics.TESTS_FAILED.inc()
+            try:
+                # Мут раньше сообщения о нем: пока ответ ждет лимита чата, пользователь уже не пишет.
+                await self.mute_user(chat_id, user_id, context)
+                await self.outbound.call(
+                    chat_id, PRIORITY_REPLY, message.reply_text, "Ответ неверный. Вы получаете мут на 5 минут."
+                )
+            except TelegramError as e:
+                metrics.TELEGRAM_ERRORS.inc()
+                logger.error(f"Ошибка при попытке наложить мут: {e}")
+            except Exception as e:
+                    logger.exception(f"Непредвиденная ошибка при попытке наложить мут: {e}")
+
+    async def is_chat_admin(self, context: ContextTypes.DEFAULT_TYPE, chat_id, user_id: int) -> bool:
+        if chat_id is None:
+            return False
+        try:
+            status = await self.chat_info.member_status(context.bot, chat_id, user_id)
+        except TelegramError as e:
+            metrics.TELEGRAM_ERRORS.inc()
+            logger.error(f"Не удалось проверить статус участника {user_id} в чате {chat_id}: {e}")
+            return False
+        return status in ("creator", "administrator")
 
     async def mute_user(self, chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
         Пытается наложить мут на пользователя (если чат является супергруппой и пользователь не является владельцем).
+        Тип чата и статус участника берутся из кэша; сам мут уходит через очередь с наивысшим приоритетом.
         """
-        chat = await context.bot.get_chat(chat_id)
-        if chat.type != "supergroup":
+        if await self.chat_info.chat_type(context.bot, chat_id) != "supergroup":
             logger.error("Нельзя применить мут: чат не является супергруппой.")
             return
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        if member.status == "creator":
+        if await self.chat_info.member_status(context.bot, chat_id, user_id) == "creator":
             logger.error("Нельзя применить мут: пользователь является владельцем чата.")
             return
         try:
             until_date = int((datetime.datetime.now() + datetime.timedelta(seconds=MUTE_TIME_SECONDS)).timestamp())
-            await context.bot.restrict_chat_member(
+            await self.outbound.call(
+                chat_id, PRIORITY_MUTE,
+                context.bot.restrict_chat_member,
                 chat_id=chat_id,
                 user_id=user_id,
                 permissions=ChatPermissions(can_send_messages=False),
                 until_date=until_date
             )
+            metrics.MUTES.inc()
             logger.info(f"Мут наложен на пользователя {user_id} в чате {chat_id} до {until_date}.")
-        except Exception as e:
+        except TelegramError as e:
+            metrics.TELEGRAM_ERRORS.inc()
             logger.error(f"Ошибка при применении мута: {e}")
+        except Exception as e:
+            logger.exception(f"Непредвиденная ошибка при применении мута: {e}")
 
+    @metrics.observe_latency(metrics.HANDLE_FEEDBACK_LATENCY)
     async def handle_feedback_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
         Обработка callback query с обратной связью.
-        Callback data имеет формат: "feedbackType|chat_id|user_id".
+        Callback data имеет формат "feedbackType|flag_id"; кнопки, выданные раньше,
+        несут "feedbackType|chat_id|user_id" и привязываются к срабатыванию по тексту.
+        Голосовать могут только администраторы и владелец чата (иначе, например, нарушитель
+        мог бы сам отметить свое сообщение как безобидное).
         Обратная связь логируется, а ответ на callback отправляется приватно администратору.
         """
         query = update.callback_query
-        await query.answer()  # Ответ без показа уведомления в чате
         data = query.data.split("|")
-        if len(data) != 3:
+        if len(data) == 2:
+            feedback_type, flag_id = data
+            chat = update.effective_chat
+            chat_id = chat.id if chat else None
+        elif len(data) == 3:
+            feedback_type, chat_id, _ = data
+            flag_id = None
+            chat_id = int(chat_id)
+        else:
             logger.error("Неверный формат callback data.")
+            await query.answer()
+            return
+        if not await self.is_chat_admin(context, chat_id, query.from_user.id):
+            await query.answer(text="Оценивать срабатывания могут только администраторы чата.", show_alert=True)
             return
-        feedback_type, chat_id, user_id = data
-        chat_id = int(chat_id)
-        user_id = int(user_id)
         # Получаем текст оригинального предупреждения, на которое ответили
         if query.message and query.message.reply_to_message:
             original_text = query.message.reply_to_message.text
         else:
             original_text = "Нет данных об оригинальном сообщении."
-        log_feedback(query.from_user.id, chat_id, feedback_type, original_text)
+        log_feedback(query.from_user.id, chat_id, feedback_type, original_text, flag_id)
         # Отправляем приватный ответ админу
         await query.answer(text="Обратная связь сохранена.", show_alert=False)
 
+    @metrics.observe_latency(metrics.HANDLE_VOICE_LATENCY)
     async def handle_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         message = update.effective_message
         if not message:
@@ -185,40 +415,44 @@ class PoliceBot:
         chat_id = chat.id
 
         # Если существует активный тест для пользователя — обрабатываем голос как ответ.
-        if (chat_id, user_id) in self.pending_tests:
+        if await self.state.get_pending_test(chat_id, user_id) is not None:
             transcription = await self.transcribe_voice(update, context)
             if not transcription:
                 logger.debug("Пустая транскрипция голосового сообщения; пропускаем анализ.")
                 return
-            expected = self.pending_tests[(chat_id, user_id)]["expected"]
-            similarity = difflib.SequenceMatcher(None, transcription.lower(), expected.lower()).ratio()
-            if similarity >= SIMILARITY_THRESHOLD:
-                try:
-                    await message.reply_text("Тест успешно пройден. Вы выглядите трезвыми!")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке подтверждения: {e}")
-                del self.pending_tests[(chat_id, user_id)]
-            else:
-                try:
-                    await message.reply_text("Ответ неверный. Вы получаете мут на 5 минут.")
-                    await self.mute_user(chat_id, user_id, context)
-                except Exception as e:
-                    logger.error(f"Ошибка при попытке наложить мут: {e}")
-                del self.pending_tests[(chat_id, user_id)]
+            # Тест забирается атомарно: ответ засчитывается ровно один раз, даже при нескольких воркерах.
+            expected = await self.state.pop_pending_test(chat_id, user_id)
+            if expected is None:
+                return
+            await self.check_test_answer(chat_id, user_id, transcription, expected, message, context)
             return
 
-        # Если нет активного теста, обрабатываем голосовое сообщение обычным образом.
-        transcription = await self.transcribe_voice(update, context)
-        if transcription:
-            needs_test = await self.nlp.analyze(transcription)
-            if needs_test:
-                log_flagged_message(user_id, chat_id, transcription)
-                await self.issue_test(chat_id, user_id, message, context)
-            else:
-                logger.debug("Голосовое сообщение не требует предупреждения (анализ транскрипции).")
-        else:
+        # Если нет активного теста, обрабатываем голосовое сообщение обычным образом:
+        # промежуточные транскрипции анализируются сразу, распознавание останавливается на первом срабатывании.
+        transcription = ""
+        verdict = None
+        try:
+            async with aclosing(self.iter_voice_transcript(update, context)) as transcripts:
+                async for transcription in transcripts:
+                    verdict = await self.analyze_text(transcription)
+                    if verdict.needs_test:
+                        break
+        except Exception as ex:
+            logger.error(f"Ошибка при распознавании голосового сообщения: {ex}")
+        if not transcription:
             logger.debug("Не удалось получить транскрипцию голосового сообщения.")
+        elif verdict is not None and verdict.needs_test:
+            # Как и для текста: кулдаун проверяется и выставляется атомарно, даже при нескольких воркерах.
+            if not await self.state.claim_warning(user_id, chat_id):
+                logger.debug(f"Предупреждение для пользователя {user_id} в чате {chat_id} уже выдано.")
+                return
+            metrics.FLAGS_VOICE.inc()
+            flag_id = log_flagged_message(user_id, chat_id, transcription, verdict.model_version, verdict.window)
+            await self.issue_test(chat_id, user_id, flag_id, message, context)
+        else:
+            logger.debug("Голосовое сообщение не требует предупреждения (анализ транскрипции).")
 
+    @metrics.observe_latency(metrics.HANDLE_TEXT_LATENCY)
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         message = update.effective_message
         if not message or not message.text:
@@ -234,22 +468,9 @@ class PoliceBot:
         text = message.text.strip()
 
         # Если пользователь ожидает тест, проверяем ответ.
-        if (chat_id, user_id) in self.pending_tests:
-            expected = self.pending_tests[(chat_id, user_id)]["expected"]
-            similarity = difflib.SequenceMatcher(None, text.lower(), expected.lower()).ratio()
-            if similarity >= SIMILARITY_THRESHOLD:
-                try:
-                    await message.reply_text("Тест успешно пройден. Вы выглядите трезвыми!")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке подтверждения: {e}")
-                del self.pending_tests[(chat_id, user_id)]
-            else:
-                try:
-                    await message.reply_text("Ответ неверный. Вы получаете мут на 5 минут.")
-                    await self.mute_user(chat_id, user_id, context)
-                except Exception as e:
-                    logger.error(f"Ошибка при попытке наложить мут: {e}")
-                del self.pending_tests[(chat_id, user_id)]
+        expected = await self.state.pop_pending_test(chat_id, user_id)
+        if expected is not None:
+            await self.check_test_answer(chat_id, user_id, text, expected, message, context)
             return
 
         # Если нет активного теста, анализируем текстовое сообщение обычным образом.
@@ -257,9 +478,14 @@ class PoliceBot:
             logger.debug(f"Кулдаун активен для пользователя {user_id} или чата {chat_id}.")
             return
 
-        needs_test = await self.nlp.analyze(text)
-        if needs_test:
-            log_flagged_message(user_id, chat_id, text)
-            await self.issue_test(chat_id, user_id, message, context)
+        verdict = await self.analyze_text(text)
+        if verdict.needs_test:
+            # Пока шел анализ, другое сообщение (или другой воркер) могло уже выдать предупреждение.
+            if not await self.state.claim_warning(user_id, chat_id):
+                logger.debug(f"Предупреждение для пользователя {user_id} в чате {chat_id} уже выдано.")
+                return
+            metrics.FLAGS_TEXT.inc()
+            flag_id = log_flagged_message(user_id, chat_id, text, verdict.model_version, verdict.window)
+            await self.issue_test(chat_id, user_id, flag_id, message, context)
         else:
             logger.debug("Текстовое сообщение не требует предупреждения.")
@@ -2,56 +2,418 @@ import logging
 from datetime import datetime
 import json
 import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.config import Config
+from app.services import metrics, profiling
 
 logger = logging.getLogger(__name__)
 
+# Старый формат журнала: один JSON-массив, переписываемый целиком. Используется только для миграции.
 TRAINING_DATA_FILE = "training_data.json"
+TRAINING_DB_FILE = Config.TRAINING_DB_PATH
+
+# training_log – сырой журнал в порядке поступления. flags и votes – индекс поверх него:
+# у каждого срабатывания свой flag_id (он же уходит в callback data кнопок обратной связи),
+# голос администратора привязан к flag_id, повторный голос того же админа заменяет прежний.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS training_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flags (
+    flag_id TEXT PRIMARY KEY,
+    log_id INTEGER NOT NULL,
+    chat_id INTEGER,
+    user_id INTEGER,
+    text TEXT NOT NULL,
+    model_version TEXT
+);
+CREATE TABLE IF NOT EXISTS votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    flag_id TEXT NOT NULL,
+    admin_id INTEGER NOT NULL,
+    feedback TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    UNIQUE (flag_id, admin_id)
+);
+"""
+
+FEEDBACK_LABELS = {"like": 1, "dislike": 0}
+
 
-def log_flagged_message(user_id: int, chat_id: int, text: str) -> None:
+def log_flagged_message(user_id: int, chat_id: int, text: str, model_version: str = None,
+                        window: int = None) -> str:
     """
-    Логирует сообщение, которое было определено как подозрительное.
+    Логирует сообщение, которое было определено как подозрительное, вместе с версией модели,
+    вынесшей вердикт, и номером окна токенов, на котором сработала модель (для длинных сообщений).
     Эти данные можно использовать для последующего обучения модели.
+    Возвращает flag_id срабатывания, к которому потом привязывается обратная связь.
     """
+    flag_id = uuid.uuid4().hex
     log_entry = {
         "timestamp": datetime.now().isoformat(),
+        "flag_id": flag_id,
         "user_id": user_id,
         "chat_id": chat_id,
         "text": text,
+        "model_version": model_version,
+        "window": window,
         "feedback": None  # Пока нет обратной связи
     }
     logger.info(f"FLAGGED MESSAGE: {log_entry}")
     _append_training_data(log_entry)
+    return flag_id
 
-def log_feedback(admin_id: int, chat_id: int, feedback: str, original_text: str) -> None:
+def log_feedback(admin_id: int, chat_id: int, feedback: str, original_text: str, flag_id: str = None) -> None:
     """
     Логирует обратную связь (лайк/дизлайк) от администратора или модератора.
     В дальнейшем эти данные помогут дообучить модель.
+    Без flag_id (кнопки, выданные до появления идентификаторов) голос привязывается
+    к последнему срабатыванию в чате с тем же текстом.
     """
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "admin_id": admin_id,
         "chat_id": chat_id,
         "feedback": feedback,
-        "original_text": original_text
+        "original_text": original_text,
+        "flag_id": flag_id,
     }
     logger.info(f"FEEDBACK: {log_entry}")
     _append_training_data(log_entry)
 
 def _append_training_data(entry: dict) -> None:
     """
-    Добавляет запись в обучающий файл. Для демонстрации используется локальный JSON-файл.
-    Реальная система должна сохранять данные в базу данных или на сервер.
+    Ставит запись в очередь фонового писателя и сразу возвращает управление.
+    Запись на диск идет пачками в append-only журнал SQLite (WAL).
     """
-    data = []
-    if os.path.exists(TRAINING_DATA_FILE):
-        try:
-            with open(TRAINING_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except Exception as ex:
-            logger.error(f"Ошибка при загрузке обучающих данных: {ex}")
-    data.append(entry)
+    _get_training_log().append(entry)
+
+def _entry_kind(entry: dict) -> str:
+    return "feedback" if "admin_id" in entry else "flagged"
+
+def open_training_db(path: str = None) -> sqlite3.Connection:
+    """
+    Открывает журнал обучающих данных, создает схему и однократно переносит записи
+    из старого training_data.json, если журнал еще пуст.
+    """
+    path = path or TRAINING_DB_FILE
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    needs_index = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'flags'").fetchone() is None
+    conn.executescript(_SCHEMA)
+    if _migrate_json_log(conn, TRAINING_DATA_FILE) or needs_index:
+        _index_existing_rows(conn)
+    return conn
+
+def _migrate_json_log(conn: sqlite3.Connection, json_path: str) -> bool:
+    if not os.path.exists(json_path):
+        return False
+    # BEGIN IMMEDIATE не дает двум воркерам одновременно перенести один и тот же файл.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM training_log LIMIT 1").fetchone() or not os.path.exists(json_path):
+            conn.rollback()
+            return False
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        conn.executemany(
+            "INSERT INTO training_log (timestamp, kind, payload) VALUES (?, ?, ?)",
+            [(e.get("timestamp", ""), _entry_kind(e), json.dumps(e, ensure_ascii=False)) for e in data],
+        )
+        conn.commit()
+    except Exception as ex:
+        conn.rollback()
+        logger.error(f"Ошибка миграции обучающих данных из {json_path}: {ex}")
+        return False
+    os.replace(json_path, json_path + ".migrated")
+    logger.info(f"Перенесено {len(data)} записей из {json_path} в журнал обучающих данных.")
+    return True
+
+def _index_existing_rows(conn: sqlite3.Connection) -> None:
+    """
+    Однократно строит flags/votes по уже накопленному журналу. Старые срабатывания получают
+    flag_id вида "log-<id>", старые голоса привязываются к ним по тексту сообщения.
+    """
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(TRAINING_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        indexed = 0
+        for row_id, payload in conn.execute("SELECT id, payload FROM training_log ORDER BY id"):
+            _index_entry(conn, row_id, json.loads(payload))
+            indexed += 1
+        conn.commit()
     except Exception as ex:
-        logger.error(f"Ошибка при сохранении обучающих данных: {ex}")
+        conn.rollback()
+        logger.error(f"Ошибка индексации журнала обучающих данных: {ex}")
+        return
+    if indexed:
+        logger.info(f"Проиндексировано {indexed} записей журнала обучающих данных.")
+
+def _index_entry(conn: sqlite3.Connection, log_id: int, entry: dict) -> None:
+    if _entry_kind(entry) == "flagged":
+        if entry.get("text") is None:
+            return
+        conn.execute(
+            "INSERT OR IGNORE INTO flags (flag_id, log_id, chat_id, user_id, text, model_version) VALUES (?, ?, ?, ?, ?, ?)",
+            (entry.get("flag_id") or f"log-{log_id}", log_id, entry.get("chat_id"), entry.get("user_id"),
+             entry["text"], entry.get("model_version")),
+        )
+        return
+    feedback = (entry.get("feedback") or "").lower()
+    if feedback not in FEEDBACK_LABELS:
+        return
+    flag_id = entry.get("flag_id") or _find_flag_by_text(conn, log_id, entry.get("chat_id"), entry.get("original_text"))
+    if flag_id is None or entry.get("admin_id") is None:
+        return
+    # REPLACE удаляет прежний голос админа и вставляет новый с большим id: последний голос побеждает,
+    # а инкрементальное обучение видит это срабатывание как измененное.
+    conn.execute(
+        "INSERT OR REPLACE INTO votes (flag_id, admin_id, feedback, timestamp) VALUES (?, ?, ?, ?)",
+        (flag_id, entry.get("admin_id"), feedback, entry.get("timestamp", "")),
+    )
+
+def _find_flag_by_text(conn: sqlite3.Connection, log_id: int, chat_id, text):
+    if not text:
+        return None
+    row = conn.execute(
+        "SELECT flag_id FROM flags WHERE chat_id = ? AND trim(text) = trim(?) AND log_id < ? ORDER BY log_id DESC LIMIT 1",
+        (chat_id, text, log_id),
+    ).fetchone()
+    return row[0] if row else None
+
+def iter_training_data(path: str = None, since_id: int = 0):
+    """
+    Построчно отдает записи журнала в порядке добавления, не загружая его в память целиком.
+    """
+    for _, entry in iter_training_rows(path, since_id):
+        yield entry
+
+def iter_labeled_examples(path: str = None, since_vote_id: int = 0):
+    """
+    Потоково отдает размеченные срабатывания: join flags и votes по индексу, без разбора журнала.
+    Метка – решение большинства (по последнему голосу каждого админа), при равенстве голосов
+    срабатывание пропускается. С since_vote_id отдаются только срабатывания, за которые
+    голосовали после этого голоса (включая смену голоса).
+    """
+    conn = open_training_db(path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT f.flag_id, f.text,
+                   SUM(v.feedback = 'like'), SUM(v.feedback = 'dislike'), MAX(v.id)
+            FROM votes v JOIN flags f ON f.flag_id = v.flag_id
+            WHERE v.flag_id IN (SELECT flag_id FROM votes WHERE id > ?)
+            GROUP BY v.flag_id
+            """,
+            (since_vote_id,),
+        )
+        for flag_id, text, likes, dislikes, last_vote_id in rows:
+            if likes == dislikes:
+                continue
+            yield {
+                "flag_id": flag_id,
+                "text": text,
+                "label": FEEDBACK_LABELS["like"] if likes > dislikes else FEEDBACK_LABELS["dislike"],
+                "votes": likes + dislikes,
+                "last_vote_id": last_vote_id,
+            }
+    finally:
+        conn.close()
+
+def iter_unvoted_flags(path: str = None):
+    """
+    Потоково отдает (flag_id, text) срабатываний, за которые еще никто не голосовал.
+    """
+    conn = open_training_db(path)
+    try:
+        yield from conn.execute(
+            """
+            SELECT f.flag_id, f.text FROM flags f
+            WHERE NOT EXISTS (SELECT 1 FROM votes v WHERE v.flag_id = f.flag_id)
+            """
+        )
+    finally:
+        conn.close()
+
+def iter_training_rows(path: str = None, since_id: int = 0):
+    """
+    Как iter_training_data, но вместе с id строки журнала. Id только растут, поэтому
+    запомненный id позволяет следующему запуску прочитать лишь новые записи.
+    """
+    conn = open_training_db(path)
+    try:
+        rows = conn.execute("SELECT id, payload FROM training_log WHERE id > ? ORDER BY id", (since_id,))
+        for row_id, payload in rows:
+            yield row_id, json.loads(payload)
+    finally:
+        conn.close()
+
+
+class TrainingLog:
+    """
+    Append-only журнал обучающих данных с фоновым писателем.
+    append() только кладет запись в ограниченную очередь; отдельный поток сбрасывает записи пачками
+    одной транзакцией, поэтому обработчики бота не ждут диска. Если журнал не открывается
+    (база заблокирована, неверный путь, нет места), писатель повторяет попытку с нарастающей паузой,
+    а записи сверх max_queue отбрасываются с ошибкой в логе.
+    """
+
+    _STOP = object()
+    _RETRY_MAX_SECONDS = 60.0
+
+    def __init__(self, path: str = None, batch_size: int = None, flush_interval: float = None,
+                 max_queue: int = None):
+        self.path = path or TRAINING_DB_FILE
+        self.batch_size = batch_size or Config.TRAINING_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.TRAINING_LOG_FLUSH_INTERVAL
+        self._queue = queue.Queue(max_queue or Config.TRAINING_LOG_MAX_QUEUE)
+        self._stopping = threading.Event()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="training-log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, entry: dict) -> None:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            metrics.TRAINING_LOG_DROPPED_QUEUE_FULL.inc()
+            # Без лавины строк в логе: первая потеря и затем каждая тысячная.
+            if self.dropped % 1000 == 1:
+                logger.error(f"Очередь журнала обучающих данных переполнена, записи отбрасываются (всего {self.dropped}).")
+
+    def flush(self) -> None:
+        # Блокирует до записи всего, что было поставлено в очередь (или до остановки писателя). Не вызывать из event loop.
+        self._queue.join()
+
+    def close(self) -> None:
+        self._stopping.set()
+        try:
+            # Будит писателя; при полной очереди он и так занят и остановится, когда она опустеет.
+            self._queue.put_nowait(self._STOP)
+        except queue.Full:
+            pass
+        self._thread.join()
+
+    def _open(self):
+        # None, если журнал так и не открылся до close().
+        delay = 1.0
+        while True:
+            try:
+                return open_training_db(self.path)
+            except Exception as ex:
+                logger.error(f"Не удалось открыть журнал обучающих данных {self.path}, повтор через {delay:.0f}s: {ex}")
+            if self._stopping.wait(delay):
+                return None
+            delay = min(delay * 2, self._RETRY_MAX_SECONDS)
+
+    def _run(self) -> None:
+        conn = None
+        try:
+            conn = self._open()
+            if conn is not None:
+                self._write_loop(conn)
+        except Exception as ex:
+            logger.exception(f"Писатель журнала обучающих данных остановлен: {ex}")
+        finally:
+            if conn is not None:
+                conn.close()
+            # Недописанное отбрасывается, чтобы flush() не ждал вечно.
+            self._discard_queued()
+
+    def _write_loop(self, conn: sqlite3.Connection) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                stopping = self._stopping.is_set()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [e for e in batch if e is not self._STOP]
+            stopping = len(entries) != len(batch)
+            try:
+                if entries:
+                    self._write_batch(conn, entries)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, conn: sqlite3.Connection, entries) -> None:
+        start = time.perf_counter()
+        try:
+            self._insert(conn, entries)
+        except Exception as ex:
+            # Откат обязателен: иначе уже вставленные строки пачки ушли бы со следующим commit
+            # без своих строк в flags/votes. Затем пачка пишется по одной, отбрасывается только плохая запись.
+            conn.rollback()
+            logger.error(f"Ошибка при сохранении пачки обучающих данных, запись по одной: {ex}")
+            for e in entries:
+                try:
+                    self._insert(conn, [e])
+                except Exception as ex:
+                    conn.rollback()
+                    self.dropped += 1
+                    metrics.TRAINING_LOG_DROPPED_WRITE_ERROR.inc()
+                    logger.error(f"Запись обучающих данных отброшена: {ex}")
+            return
+        if profiling.ENABLED:
+            profiling.record_log_write(len(entries), time.perf_counter() - start)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, entries) -> None:
+        for e in entries:
+            cursor = conn.execute(
+                "INSERT INTO training_log (timestamp, kind, payload) VALUES (?, ?, ?)",
+                (e.get("timestamp", ""), _entry_kind(e), json.dumps(e, ensure_ascii=False)),
+            )
+            _index_entry(conn, cursor.lastrowid, e)
+        conn.commit()
+
+    def _discard_queued(self) -> None:
+        discarded = 0
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            discarded += entry is not self._STOP
+        if discarded:
+            self.dropped += discarded
+            metrics.TRAINING_LOG_DROPPED_CLOSED.inc(discarded)
+            logger.error(f"Журнал обучающих данных закрыт, не записано {discarded} записей.")
+
+
+_training_log = None
+_training_log_lock = threading.Lock()
+
+def _get_training_log() -> TrainingLog:
+    global _training_log
+    if _training_log is None:
+        with _training_log_lock:
+            if _training_log is None:
+                _training_log = TrainingLog()
+    return _training_log
+
+def close_training_log() -> None:
+    """
+    Дописывает очередь и останавливает фонового писателя (вызывается при остановке приложения).
+    """
+    global _training_log
+    with _training_log_lock:
+        if _training_log is not None:
+            _training_log.close()
+            _training_log = None
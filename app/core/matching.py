@@ -0,0 +1,128 @@
+# расположен в: police-bot-prod/app/core/matching.py
+
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Приводит ответ к сравнимому виду: нижний регистр, «ё» -> «е», пунктуация и символы
+    (тире, кавычки, эмодзи) заменяются пробелами, пробелы схлопываются.
+    """
+    return _NON_WORD_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """
+    Расстояние Левенштейна, если оно не больше limit, иначе limit + 1.
+    Считается только полоса шириной 2 * limit + 1 вокруг диагонали, и расчет прерывается,
+    как только минимум строки превысил limit: O(limit * len) вместо O(len(a) * len(b)).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Общие префикс и суффикс не влияют на расстояние, а у правильного ответа это почти вся строка.
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if not a or not b:
+        return max(len(a), len(b))
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = limit + 1
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - limit)
+        hi = min(len(b), i + limit)
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= limit else too_far
+        row_min = current[0]
+        ch = a[i - 1]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (ch != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost <= limit else too_far
+            if current[j] < row_min:
+                row_min = current[j]
+        if row_min > limit:
+            return too_far
+        previous = current
+    return previous[len(b)]
+
+
+class PreparedTwister:
+    __slots__ = ("text", "normalized", "length")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.normalized = normalize_answer(text)
+        self.length = len(self.normalized)
+
+
+class AnswerMatcher:
+    """
+    Проверка ответа на тест на трезвость.
+    Похожесть = 1 - расстояние Левенштейна / длина более длинной строки. Для каждой скороговорки
+    нормализация выполняется один раз при загрузке, а стоимость проверки зависит только от
+    ожидаемой скороговорки, но не от размера корпуса.
+    """
+
+    # Сырой ответ длиннее ожидаемого во столько раз отбрасывается еще до нормализации.
+    RAW_LENGTH_FACTOR = 3
+
+    def __init__(self, twisters, threshold: float):
+        self.threshold = threshold
+        self._prepared = {twister: PreparedTwister(twister) for twister in twisters}
+
+    def prepare(self, expected: str) -> PreparedTwister:
+        prepared = self._prepared.get(expected)
+        if prepared is None:
+            # Скороговорка могла прийти из общего состояния другого воркера с другим корпусом.
+            prepared = PreparedTwister(expected)
+        return prepared
+
+    def matches(self, answer: str, expected: str) -> bool:
+        prepared = self.prepare(expected)
+        if len(answer) > self.RAW_LENGTH_FACTOR * max(len(prepared.text), 1) + 16:
+            return False
+        normalized = normalize_answer(answer)
+        longest = max(len(normalized), prepared.length)
+        if not longest:
+            return True
+        # Допустимое число правок при данной длине; разница длин – нижняя граница расстояния.
+        limit = int((1.0 - self.threshold) * longest + 1e-9)
+        if abs(len(normalized) - prepared.length) > limit:
+            return False
+        return bounded_levenshtein(normalized, prepared.normalized, limit) <= limit
+
+
+def load_tongue_twisters(path: str, default):
+    """
+    Загружает корпус скороговорок (по одной в строке, # – комментарий). Если файл не задан
+    или не найден, используется встроенный список.
+    """
+    if not path:
+        return list(default)
+    if not os.path.exists(path):
+        logger.error(f"Файл скороговорок {path} не найден; используется встроенный список.")
+        return list(default)
+    with open(path, "r", encoding="utf-8") as f:
+        twisters = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not twisters:
+        logger.error(f"Файл скороговорок {path} пуст; используется встроенный список.")
+        return list(default)
+    logger.info(f"Загружено скороговорок: {len(twisters)} из {path}")
+    return twisters
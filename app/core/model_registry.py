@@ -0,0 +1,90 @@
+"""
+Versioned storage of fine-tuned models.
+Each training run saves into its own directory under FINE_TUNED_DIR and then atomically
+rewrites manifest.json, so a running bot never sees a half-written model:
+
+    app/models/fine_tuned_model/
+        manifest.json          {"current": "<version>", "previous": "<version>", "versions": {...}}
+        20261016T021500/       model + tokenizer files
+        ...
+
+A model saved directly into FINE_TUNED_DIR (the layout before versioning) is still picked up.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+from app.config import Config
+
+FINE_TUNED_DIR = "app/models/fine_tuned_model"
+MANIFEST_FILE = os.path.join(FINE_TUNED_DIR, "manifest.json")
+
+
+def read_manifest() -> dict:
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_model_source():
+    """
+    Return (source, version) of the model the bot should serve: the current fine-tuned
+    version if one is published, otherwise the base model.
+    """
+    current = read_manifest().get("current")
+    if current and os.path.isdir(os.path.join(FINE_TUNED_DIR, current)):
+        return os.path.join(FINE_TUNED_DIR, current), f"fine_tuned@{current}"
+    legacy_config = os.path.join(FINE_TUNED_DIR, "config.json")
+    if os.path.exists(legacy_config):
+        return FINE_TUNED_DIR, f"fine_tuned@{int(os.path.getmtime(legacy_config))}"
+    return Config.MODEL_PATH, Config.MODEL_PATH
+
+
+def new_version_dir():
+    """
+    Return (version, directory) for a new training run; the directory is not published yet.
+    """
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return version, os.path.join(FINE_TUNED_DIR, version)
+
+
+def publish_version(version: str, **metadata) -> None:
+    """
+    Make `version` the current model. The manifest is replaced atomically.
+    """
+    manifest = read_manifest()
+    manifest.setdefault("versions", {})[version] = {
+        "published_at": datetime.now(timezone.utc).isoformat(),
+        **metadata,
+    }
+    if manifest.get("current") != version:
+        manifest["previous"] = manifest.get("current")
+    manifest["current"] = version
+    _write_manifest(manifest)
+
+
+def rollback_version():
+    """
+    Republish the manifest's "previous" version as current (and current as previous), so every
+    worker and the inference server switch back on their next manifest check. Returns the version
+    now current (None means the base model), or False if there is nothing to roll back to.
+    """
+    manifest = read_manifest()
+    current, previous = manifest.get("current"), manifest.get("previous")
+    if not current or (previous and not os.path.isdir(os.path.join(FINE_TUNED_DIR, previous))):
+        return False
+    manifest["current"], manifest["previous"] = previous, current
+    manifest["rolled_back_at"] = datetime.now(timezone.utc).isoformat()
+    _write_manifest(manifest)
+    return previous
+
+
+def _write_manifest(manifest: dict) -> None:
+    os.makedirs(FINE_TUNED_DIR, exist_ok=True)
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_FILE)
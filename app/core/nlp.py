@@ -1,24 +1,513 @@
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-import torch
-import os
+import asyncio
+import itertools
+import json
+import logging
+import struct
+import time
+from typing import NamedTuple, Optional
+
+from app.config import Config
+from app.core.backends import load_backend
+from app.core.batching import MicroBatcher
+from app.core.model_registry import resolve_model_source, rollback_version
+from app.services import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+TOXICITY_THRESHOLD = 0.7
+# Retry interval for a model that failed to load when MODEL_RELOAD_INTERVAL is longer or disabled.
+LOAD_RETRY_SECONDS = 30.0
+
+class Verdict(NamedTuple):
+    needs_test: bool
+    score: Optional[float]
+    model_version: str
+    # Index of the token window that decided the verdict (long messages are split into windows).
+    window: Optional[int] = None
+
+class ModelUnavailable(RuntimeError):
+    """
+    The initial model load failed and no model (local or on the inference server) is ready yet;
+    the watcher keeps retrying in the background.
+    """
+
+class ModelHandle:
+    """
+    A loaded model version. Batches capture the handle once, so a swap never mixes models
+    inside a batch and in-flight requests finish on the model they started with.
+    """
+    __slots__ = ("version", "backend", "tokenizer")
+
+    def __init__(self, version, backend, tokenizer):
+        self.version = version
+        self.backend = backend
+        self.tokenizer = tokenizer
 
 class NLPProcessor:
-    def __init__(self):
-        # If a fine-tuned model exists, load it; otherwise load the base model.
-        fine_tuned_dir = "app/models/fine_tuned_model"
-        if os.path.exists(fine_tuned_dir):
-            self.model = AutoModelForSequenceClassification.from_pretrained(fine_tuned_dir)
-            self.tokenizer = AutoTokenizer.from_pretrained(fine_tuned_dir)
-        else:
-            self.model = AutoModelForSequenceClassification.from_pretrained("cointegrated/rubert-tiny-toxicity")
-            self.tokenizer = AutoTokenizer.from_pretrained("cointegrated/rubert-tiny-toxicity")
-        self.model.eval()
-        
+    def __init__(self, remote_path: str = None):
+        # The model is loaded by load() in the background; analyze() waits for it.
+        self.active = None
+        self.previous = None
+        # Last manifest version we acted on, and the one before it (the version of `previous`).
+        self._seen_version = None
+        self._previous_seen = None
+        # Version the initial load() is expected to serve; see cache_version.
+        self._pending_version = None
+        self._loaded = None
+        # Error of the failed initial load; cleared once a model is ready.
+        self.load_error = None
+        self._reload_lock = None
+        # Per-phase durations (seconds) of the most recent model load.
+        self.load_timings = {}
+        self._watcher = None
+        # Concurrent analyze() calls are coalesced into a single forward pass off the event loop.
+        self.batcher = MicroBatcher(
+            self._score_batch,
+            max_batch_size=Config.NLP_BATCH_MAX_SIZE,
+            max_wait_ms=Config.NLP_BATCH_MAX_WAIT_MS,
+            threads=Config.NLP_INFERENCE_THREADS,
+        )
+        # With INFERENCE_SOCKET set, scoring goes to the shared inference server and the model is
+        # loaded in this process only as a fallback while the server is unavailable.
+        remote_path = Config.INFERENCE_SOCKET if remote_path is None else remote_path
+        self.remote = InferenceClient(remote_path) if remote_path else None
+        self._remote_failures = 0
+
+    @property
+    def remote_ready(self) -> bool:
+        return self.remote is not None and self.remote.connected
+
+    @property
+    def model_version(self) -> Optional[str]:
+        if self.remote_ready:
+            return self.remote.version
+        return self.active.version if self.active is not None else None
+
+    @property
+    def cache_version(self) -> Optional[str]:
+        """
+        Version to look cached verdicts up under: the serving model's or, while the initial load is
+        still running, the version being loaded (published version with the configured backend).
+        """
+        return self.model_version or self._pending_version
+
+    @property
+    def is_ready(self) -> bool:
+        return self.remote_ready or self.active is not None
+
+    def _loaded_event(self) -> asyncio.Event:
+        if self._loaded is None:
+            self._loaded = asyncio.Event()
+        return self._loaded
+
+    async def wait_ready(self) -> None:
+        # Raises ModelUnavailable at once after a failed initial load instead of waiting for a retry.
+        if self.active is None and not self.remote_ready:
+            if self.load_error is None:
+                await self._loaded_event().wait()
+            if self.active is None and not self.remote_ready:
+                raise ModelUnavailable(f"Model is not loaded: {self.load_error}")
+
+    def _load(self, source: str, version: str) -> ModelHandle:
+        start = time.perf_counter()
+        # The first call also pays for importing torch/transformers (see app.core.backends).
+        backend, tokenizer = load_backend(Config.NLP_BACKEND, source)
+        loaded = time.perf_counter()
+        # Quantized/ONNX scores differ slightly from fp32, so the backend is part of the version.
+        handle = ModelHandle(f"{version}/{backend.name}", backend, tokenizer)
+        # Warm-up pass so the first real message does not pay for lazy allocations.
+        self._run(handle, ["warm-up"])
+        warmed = time.perf_counter()
+        self.load_timings = {"model_load": loaded - start, "warm_up": warmed - loaded}
+        logger.info(
+            f"Loaded model {handle.version} from {source} "
+            f"(load {loaded - start:.2f}s, warm-up {warmed - loaded:.2f}s)"
+        )
+        return handle
+
+    @staticmethod
+    def _run(handle: ModelHandle, texts, timings: dict = None):
+        """
+        Return (score, window) per text. Texts longer than NLP_WINDOW_TOKENS are split into
+        overlapping token windows (at most NLP_MAX_WINDOWS); a text's score is its highest window
+        score. First windows of all texts go in one forward pass, then every following pass takes
+        the next window index of the texts still below TOXICITY_THRESHOLD, so a text stops being
+        scored at its first window over the threshold. If `timings` is given, tokenize/forward seconds are added to it.
+        """
+        start = time.perf_counter()
+        tokenizer = handle.tokenizer
+        # Fast tokenizers cut the windows themselves; slow ones only support plain truncation.
+        overflow = getattr(tokenizer, "is_fast", False)
+        encoded = tokenizer(
+            texts,
+            truncation=True,
+            max_length=Config.NLP_WINDOW_TOKENS,
+            stride=Config.NLP_WINDOW_STRIDE if overflow else 0,
+            return_overflowing_tokens=overflow,
+        )
+        sample_of_row = encoded.pop("overflow_to_sample_mapping", None) or range(len(texts))
+        windows = [[] for _ in texts]
+        capped = 0
+        for row, sample in enumerate(sample_of_row):
+            if len(windows[sample]) < Config.NLP_MAX_WINDOWS:
+                windows[sample].append(row)
+            else:
+                capped += 1
+        tokenize_seconds = time.perf_counter() - start
+        metrics.TOKENIZE_SECONDS.observe(tokenize_seconds)
+        if timings is not None:
+            timings["tokenize"] = tokenize_seconds
+
+        def forward(rows):
+            forward_start = time.perf_counter()
+            # Dynamic padding: every pass is padded to its own longest window, not to max_length.
+            features = [{key: values[row] for key, values in encoded.items()} for row in rows]
+            inputs = tokenizer.pad(features, return_tensors=handle.backend.tensor_type)
+            scores = handle.backend.scores(inputs)
+            forward_seconds = time.perf_counter() - forward_start
+            metrics.FORWARD_SECONDS.observe(forward_seconds)
+            if timings is not None:
+                timings["forward"] = timings.get("forward", 0.0) + forward_seconds
+            return scores
+
+        results = [(score, 0) for score in forward([rows[0] for rows in windows])]
+        scored = len(texts)
+        # One window index per pass: a text never has two windows in the same pass, so it stops
+        # at the first window over the threshold.
+        for index in range(1, Config.NLP_MAX_WINDOWS):
+            samples = [
+                sample for sample in range(len(texts))
+                if index < len(windows[sample]) and results[sample][0] < TOXICITY_THRESHOLD
+            ]
+            if not samples:
+                break
+            for i in range(0, len(samples), Config.NLP_BATCH_MAX_SIZE):
+                chunk = samples[i:i + Config.NLP_BATCH_MAX_SIZE]
+                for sample, score in zip(chunk, forward([windows[sample][index] for sample in chunk])):
+                    if score > results[sample][0]:
+                        results[sample] = (score, index)
+                scored += len(chunk)
+        metrics.WINDOWS_SCORED.inc(scored)
+        metrics.WINDOWS_SKIPPED.inc(sum(len(rows) for rows in windows) - scored)
+        if capped:
+            metrics.WINDOWS_CAPPED.inc(capped)
+        return results
+
+    def _score_batch(self, texts):
+        metrics.BATCH_SIZE.observe(len(texts))
+        handle = self.active
+        if handle is None:
+            # Released because the worker reconnected to the inference server while the batch was queued.
+            raise ModelUnavailable("In-process model was released")
+        # Batch timings are shared by every message of the batch; collected only while profiling.
+        timings = {} if profiling.ENABLED else None
+        return [(score, handle.version, window, timings) for score, window in self._run(handle, texts, timings)]
+
+    async def predict(self, text: str) -> Verdict:
+        await self.wait_ready()
+        if self.remote_ready:
+            # While the connection is up, a timeout or a server-side error leaves only this text unscored
+            # (no local model is loaded for one slow batch); after INFERENCE_MAX_FAILURES of them in a row
+            # the connection is dropped, since a hung server keeps its socket open.
+            try:
+                toxicity_score, version, window = await self.remote.score(text)
+                self._remote_failures = 0
+                return Verdict(toxicity_score >= TOXICITY_THRESHOLD, toxicity_score, version, window)
+            except InferenceUnavailable as ex:
+                logger.error(f"Inference server unavailable, falling back to in-process inference: {ex}")
+                await self.remote.close()
+            except (InferenceError, asyncio.TimeoutError) as ex:
+                self._remote_failures += 1
+                if self._remote_failures < Config.INFERENCE_MAX_FAILURES:
+                    logger.warning(
+                        f"Inference server request failed ({self._remote_failures} in a row), "
+                        f"message left unscored: {str(ex) or 'timeout'}"
+                    )
+                    return Verdict(False, None, "unavailable")
+                logger.error("Too many failed inference server requests, falling back to in-process inference")
+                self._remote_failures = 0
+                await self.remote.close()
+        await self._ensure_local()
+        toxicity_score, version, window, timings = await self.batcher.submit(text)
+        if timings:
+            for stage, seconds in timings.items():
+                profiling.add(stage, seconds)
+        return Verdict(toxicity_score >= TOXICITY_THRESHOLD, toxicity_score, version, window)
+
     async def analyze(self, text: str) -> bool:
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = self.model(**inputs, return_dict=True)
-        probabilities = torch.sigmoid(outputs.logits).tolist()[0]
-        toxicity_score = probabilities[0] if probabilities else 0.0
-        threshold = 0.7
-        return toxicity_score >= threshold
+        return (await self.predict(text)).needs_test
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Load the currently published model version in the background, warm it up and swap it in.
+        Returns False if there is nothing new to load.
+        """
+        async with self._lock():
+            return await self._reload_locked(force)
+
+    def _lock(self) -> asyncio.Lock:
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        return self._reload_lock
+
+    async def _reload_locked(self, force: bool) -> bool:
+        source, version = resolve_model_source()
+        if not force and version == self._seen_version:
+            return False
+        if self.previous is not None and version == self._previous_seen:
+            # A rollback through the manifest: the previous model is still in memory.
+            handle = self.previous
+        else:
+            loop = asyncio.get_running_loop()
+            handle = await loop.run_in_executor(None, self._load, source, version)
+        self.previous, self.active = self.active, handle
+        self._previous_seen, self._seen_version = self._seen_version, version
+        self.load_error = None
+        self._loaded_event().set()
+        if self.previous is not None:
+            logger.info(f"Switched model to {handle.version} (previous: {self.previous.version})")
+        return True
+
+    async def _ensure_local(self) -> None:
+        if self.active is not None:
+            return
+        async with self._lock():
+            if self.active is None:
+                await self._reload_locked(force=True)
+
+    async def _connect_remote(self, wait: float = 0.0) -> bool:
+        # `wait` covers a server that is still loading its model when the workers start.
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                await self.remote.connect()
+                break
+            except (OSError, InferenceError, asyncio.TimeoutError) as ex:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Inference server {self.remote.path} unavailable: {ex}")
+                    return False
+            await asyncio.sleep(1.0)
+        logger.info(f"Using inference server {self.remote.path} (model {self.remote.version})")
+        async with self._lock():
+            # The fallback model is only for outages: keeping it would give every worker its own copy again.
+            if self.active is not None:
+                logger.info(f"Releasing in-process model {self.active.version}")
+            self.active = self.previous = None
+            self._seen_version = self._previous_seen = None
+        self._remote_failures = 0
+        self.load_error = None
+        self._loaded_event().set()
+        return True
+
+    async def load(self) -> None:
+        """
+        Initial model load and warm-up; meant to run as a background task at startup.
+        With an inference server configured, only a connection to it is made.
+        On failure the error is kept in `load_error` and callers waiting in wait_ready() are woken up.
+        """
+        self._pending_version = f"{resolve_model_source()[1]}/{Config.NLP_BACKEND}"
+        try:
+            if self.remote is not None and await self._connect_remote(Config.INFERENCE_CONNECT_WAIT):
+                return
+            await self.reload(force=True)
+        except Exception as ex:
+            self.load_error = ex
+            self._loaded_event().set()
+            raise
+
+    async def rollback(self):
+        """
+        Republish the manifest's previous version (see model_registry.rollback_version). This process
+        switches right away, other workers and the inference server on their next manifest check.
+        Returns the version now current (None for the base model) or False if there is none to go back to.
+        """
+        version = await asyncio.to_thread(rollback_version)
+        if version is False:
+            return False
+        logger.info(f"Rolled model back to {version or Config.MODEL_PATH}")
+        if not self.remote_ready:
+            await self.reload()
+        return version
+
+    async def _watch(self) -> None:
+        interval = Config.MODEL_RELOAD_INTERVAL
+        while True:
+            # Until a model is ready the load is retried at least every LOAD_RETRY_SECONDS.
+            if self.is_ready:
+                await asyncio.sleep(interval)
+            else:
+                await asyncio.sleep(min(interval, LOAD_RETRY_SECONDS) if interval > 0 else LOAD_RETRY_SECONDS)
+            try:
+                if self.remote is not None and not self.remote.connected:
+                    # A reconnect releases the fallback model; batches already running keep their handle.
+                    await self._connect_remote()
+                if not self.remote_ready:
+                    await self.reload()
+            except Exception as ex:
+                logger.error(f"Failed to reload model: {ex}")
+            if interval <= 0 and self.is_ready:
+                return
+
+    def start_watcher(self) -> None:
+        # Polls the model manifest (or reconnects to the inference server); MODEL_RELOAD_INTERVAL=0
+        # disables automatic reloads, but a failed initial load is still retried until it succeeds.
+        if self._watcher is None and (Config.MODEL_RELOAD_INTERVAL > 0 or not self.is_ready):
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        if self.remote is not None:
+            await self.remote.close()
+        await self.batcher.close()
+
+
+# Inference server protocol (see app/services/inference_server.py): every frame is a 4-byte
+# big-endian length followed by a UTF-8 JSON object.
+#   request:  {"id": 1, "texts": ["...", ...]}       or {"id": 1, "op": "hello"}
+#   response: {"id": 1, "results": [[score, model_version, window], ...]}
+#             {"id": 1, "version": "<model_version>"} or {"id": 1, "error": "..."}
+_FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+class InferenceUnavailable(ConnectionError):
+    """
+    The connection to the inference server is closed, reset or broken; NLPProcessor falls back to
+    in-process inference.
+    """
+
+
+class InferenceError(RuntimeError):
+    """
+    The inference server answered a request with an error frame; the connection is still usable.
+    """
+
+
+def encode_frame(message: dict) -> bytes:
+    payload = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    (length,) = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise InferenceUnavailable(f"Frame of {length} bytes exceeds the limit")
+    return json.loads(await reader.readexactly(length))
+
+
+class InferenceClient:
+    """
+    Connection to the local inference server. Texts submitted in the same event loop tick
+    go out as one frame; responses are matched to requests by id, so any number of frames
+    can be in flight on the single connection.
+    """
+
+    def __init__(self, path: str, timeout: float = None):
+        self.path = path
+        self.timeout = timeout if timeout is not None else Config.INFERENCE_TIMEOUT
+        self.version = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._ids = itertools.count(1)
+        self._waiting = {}   # request id -> list of futures, one per text
+        self._batch = []     # (text, future) waiting for the next flush
+        self._flush_scheduled = False
+
+    @property
+    def connected(self) -> bool:
+        return self._read_task is not None and not self._read_task.done()
+
+    async def connect(self) -> None:
+        # A previous connection (possibly to a hung server) is closed before a new one is opened.
+        await self.close()
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+        future = asyncio.get_running_loop().create_future()
+        request_id = next(self._ids)
+        self._waiting[request_id] = [future]
+        self._writer.write(encode_frame({"id": request_id, "op": "hello"}))
+        try:
+            self.version = await asyncio.wait_for(future, self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def score(self, text: str):
+        """
+        Return (score, model_version, window) for one text.
+        """
+        if not self.connected:
+            raise InferenceUnavailable("Not connected to the inference server")
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((text, future))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._drop_finished()
+            raise
+
+    def _drop_finished(self) -> None:
+        # Requests whose every text timed out will not be waited for; a late response is ignored.
+        finished = [request_id for request_id, futures in self._waiting.items() if all(f.done() for f in futures)]
+        for request_id in finished:
+            del self._waiting[request_id]
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        request_id = next(self._ids)
+        self._waiting[request_id] = [future for _, future in batch]
+        try:
+            self._writer.write(encode_frame({"id": request_id, "texts": [text for text, _ in batch]}))
+        except Exception as ex:
+            self._fail_all(InferenceUnavailable(f"Failed to send to the inference server: {ex}"))
+            # The reader then sees EOF, so `connected` turns False.
+            self._writer.close()
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                message = await read_frame(self._reader)
+                futures = self._waiting.pop(message.get("id"), [])
+                if "error" in message:
+                    error = InferenceError(f"Inference server error: {message['error']}")
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                results = message["results"] if "results" in message else [message.get("version")]
+                for future, result in zip(futures, results):
+                    if not future.done():
+                        future.set_result(tuple(result) if isinstance(result, list) else result)
+                if "results" in message and results:
+                    self.version = results[-1][1]
+        except (OSError, asyncio.IncompleteReadError, ValueError) as ex:
+            self._fail_all(InferenceUnavailable(f"Inference server connection lost: {ex}"))
+
+    def _fail_all(self, error: Exception) -> None:
+        waiting, self._waiting = self._waiting, {}
+        batch, self._batch = self._batch, []
+        for futures in waiting.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self) -> None:
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_all(InferenceUnavailable("Inference client closed"))
@@ -0,0 +1,194 @@
+"""
+Cheap pre-filter cascade in front of the transformer.
+Every text goes through the stages below until one of them resolves it:
+    1. lexicon  - a known toxic stem occurs (trie-compiled regex): always sent to the transformer.
+    2. trivial  - nothing but links, mentions, emoji, digits or a very short reply: cleared.
+    3. linear   - hashed character n-gram logistic regression; a score below
+                  PREFILTER_CLEAR_THRESHOLD clears the message.
+    4. model    - everything else goes to the transformer.
+The cascade never flags anything itself, it only decides what may skip the model, so raising
+PREFILTER_CLEAR_THRESHOLD trades recall for a higher benign-skip rate.
+The linear model is trained by `python -m app.services.train_prefilter`.
+"""
+
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+STAGE_TRIVIAL = "trivial"
+STAGE_LEXICON = "lexicon"
+STAGE_LINEAR = "linear"
+STAGE_MODEL = "model"
+STAGES = (STAGE_TRIVIAL, STAGE_LEXICON, STAGE_LINEAR, STAGE_MODEL)
+
+# Stems are matched at the start of a word; extend via PREFILTER_LEXICON_FILE (one stem per line).
+DEFAULT_LEXICON = (
+    "бля", "гандон", "дебил", "долбо", "еба", "ебл", "ебу", "заткн", "идиот", "мраз",
+    "мудак", "мудил", "пизд", "сдохн", "сука", "суки", "тварь", "убью", "урод", "хуе",
+    "хуй", "хуя", "чмо", "шлюх",
+)
+
+_NOISE_RE = re.compile(r"(?:https?://|www\.)\S+|[@/#]\w+", re.IGNORECASE)
+_LETTERS_RE = re.compile(r"[^\W\d_]")
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def compile_lexicon(stems) -> re.Pattern:
+    """
+    Compile word-prefix stems into a single regex shaped like a trie, so matching cost does not
+    grow with the number of alternatives sharing a prefix.
+    """
+    trie = {}
+    for stem in stems:
+        node = trie
+        for ch in normalize(stem.strip()):
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def to_regex(node) -> str:
+        # A stem ends here: anything longer also matches, so the subtree is irrelevant.
+        if "" in node:
+            return ""
+        branches = [re.escape(ch) + to_regex(child) for ch, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    if not trie:
+        return re.compile(r"(?!x)x")
+    return re.compile(r"(?<!\w)" + to_regex(trie))
+
+
+def load_lexicon(path: str = None):
+    stems = list(DEFAULT_LEXICON)
+    path = path if path is not None else Config.PREFILTER_LEXICON_FILE
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            stems.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return stems
+
+
+class HashedNgramModel:
+    """
+    Logistic regression over L2-normalized counts of hashed character n-grams.
+    crc32 is used instead of hash() so that feature indices are stable across processes.
+    """
+
+    def __init__(self, weights, bias=0.0, n_min=2, n_max=4):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.n_min = n_min
+        self.n_max = n_max
+
+    @property
+    def n_buckets(self) -> int:
+        return len(self.weights)
+
+    def features(self, text: str):
+        padded = f" {normalize(text)} "
+        n_buckets = self.n_buckets
+        counts = {}
+        for n in range(self.n_min, self.n_max + 1):
+            for i in range(len(padded) - n + 1):
+                bucket = zlib.crc32(padded[i:i + n].encode("utf-8")) % n_buckets
+                counts[bucket] = counts.get(bucket, 0) + 1
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        norm = float(np.sqrt(values @ values))
+        if norm:
+            values /= norm
+        return indices, values
+
+    def score(self, text: str) -> float:
+        indices, values = self.features(text)
+        z = self.bias + float(self.weights[indices] @ values)
+        return 1.0 / (1.0 + np.exp(-z))
+
+    @classmethod
+    def train(cls, texts, labels, n_buckets=2 ** 18, epochs=5, learning_rate=0.5, l2=1e-6, seed=0):
+        model = cls(np.zeros(n_buckets, dtype=np.float32))
+        samples = [(model.features(text), float(label)) for text, label in zip(texts, labels)]
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            for i in rng.permutation(len(samples)):
+                (indices, values), label = samples[i]
+                z = model.bias + float(model.weights[indices] @ values)
+                gradient = 1.0 / (1.0 + np.exp(-z)) - label
+                model.weights[indices] -= learning_rate * (gradient * values + l2 * model.weights[indices])
+                model.bias -= learning_rate * gradient
+        return model
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, ngram=np.array([self.n_min, self.n_max]))
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramModel":
+        with np.load(path) as data:
+            n_min, n_max = (int(n) for n in data["ngram"])
+            return cls(data["weights"], float(data["bias"]), n_min, n_max)
+
+
+class Prefilter:
+    def __init__(self, lexicon=None, linear_model=None, clear_threshold=None, short_chars=None, max_chars=None):
+        self.lexicon = compile_lexicon(lexicon if lexicon is not None else load_lexicon())
+        self.linear_model = linear_model
+        self.clear_threshold = clear_threshold if clear_threshold is not None else Config.PREFILTER_CLEAR_THRESHOLD
+        self.short_chars = short_chars if short_chars is not None else Config.PREFILTER_SHORT_CHARS
+        self.max_chars = max_chars if max_chars is not None else Config.PREFILTER_MAX_CHARS
+        # Number of texts resolved by each stage; "model" counts what went on to the transformer.
+        self.resolved = dict.fromkeys(STAGES, 0)
+
+    @classmethod
+    def from_config(cls) -> "Prefilter":
+        linear_model = None
+        path = Config.PREFILTER_MODEL_PATH
+        if path and os.path.exists(path):
+            try:
+                linear_model = HashedNgramModel.load(path)
+            except Exception as ex:
+                logger.error(f"Failed to load pre-filter model {path}: {ex}")
+        return cls(linear_model=linear_model)
+
+    def route(self, text: str):
+        """
+        Return (cleared, stage) without touching the counters.
+        """
+        normalized = normalize(text)
+        letters = len(_LETTERS_RE.findall(_NOISE_RE.sub(" ", normalized)))
+        if self.lexicon.search(normalized):
+            return False, STAGE_LEXICON
+        if letters <= self.short_chars:
+            return True, STAGE_TRIVIAL
+        if (self.linear_model is not None and len(text) <= self.max_chars
+                and self.linear_model.score(text) < self.clear_threshold):
+            return True, STAGE_LINEAR
+        return False, STAGE_MODEL
+
+    def clears(self, text: str) -> bool:
+        """
+        True if the text can skip the transformer; counts the stage that resolved it.
+        """
+        cleared, stage = self.route(text)
+        self.resolved[stage] += 1
+        return cleared
+
+    def stats(self) -> dict:
+        total = sum(self.resolved.values())
+        return {
+            "total": total,
+            "resolved": dict(self.resolved),
+            "fractions": {stage: (count / total if total else 0.0) for stage, count in self.resolved.items()},
+            "clear_threshold": self.clear_threshold,
+            "linear_model": self.linear_model is not None,
+        }
@@ -0,0 +1,90 @@
+# расположен в: police-bot-prod/app/core/serial_executor.py
+
+import asyncio
+import itertools
+import time
+from collections import deque
+
+from app.services import metrics
+
+
+class _KeyQueue:
+    __slots__ = ("lock", "enqueued", "running")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.enqueued = deque()  # (время постановки, номер) ожидающих задач, в порядке очереди
+        self.running = False
+
+
+class KeyedSerialExecutor:
+    """
+    Выполняет корутины с одинаковым ключом строго по очереди, с разными ключами – параллельно,
+    но не больше max_concurrency одновременно. Ключ бота – (chat_id, user_id): сообщения одного
+    пользователя в чате обрабатываются в порядке поступления, поэтому проверка и снятие
+    ожидающего теста не гоняются друг с другом. Слот общего лимита занимает только задача,
+    дошедшая до головы своей очереди, так что очередь одного пользователя не держит остальных.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._queues = {}  # key -> _KeyQueue; удаляется, когда очередь пустеет
+        self._tickets = itertools.count()
+        self._waiting = 0
+        self.completed = 0
+
+    async def run(self, key, func, *args, **kwargs):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _KeyQueue()
+        ticket = (time.monotonic(), next(self._tickets))
+        queue.enqueued.append(ticket)
+        self._waiting += 1
+        started = False
+        try:
+            # asyncio.Lock будит ожидающих по порядку, новые задачи не обгоняют очередь.
+            async with queue.lock:
+                async with self._slots:
+                    queue.enqueued.remove(ticket)
+                    self._waiting -= 1
+                    started = True
+                    queue.running = True
+                    metrics.UPDATE_QUEUE_WAIT.observe(time.monotonic() - ticket[0])
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        queue.running = False
+                        self.completed += 1
+        finally:
+            if not started:
+                # Задача отменена, не дойдя до выполнения.
+                queue.enqueued.remove(ticket)
+                self._waiting -= 1
+            if not queue.enqueued and not queue.running and not queue.lock.locked():
+                self._queues.pop(key, None)
+
+    def queued(self) -> int:
+        return self._waiting
+
+    def stats(self, top: int = 10) -> dict:
+        """
+        Общая картина очередей и самые длинные из них: глубина и время ожидания первого в очереди.
+        """
+        now = time.monotonic()
+        depths = [
+            (len(queue.enqueued), now - queue.enqueued[0][0] if queue.enqueued else 0.0, key)
+            for key, queue in self._queues.items()
+        ]
+        depths.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": sum(1 for queue in self._queues.values() if queue.running),
+            "queued": sum(depth for depth, _, _ in depths),
+            "keys": len(depths),
+            "completed": self.completed,
+            "top_keys": [
+                {"key": list(key) if isinstance(key, tuple) else key, "depth": depth, "oldest_wait_seconds": wait}
+                for depth, wait, key in depths[:top] if depth
+            ],
+        }
@@ -0,0 +1,270 @@
+# расположен в: police-bot-prod/app/core/state.py
+
+import logging
+import time
+from typing import Optional
+
+from app.config import Config
+from app.services import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """
+    Колесо таймеров для истечения TTL: ключ попадает в слот своего тика истечения,
+    а advance() обходит только слоты прошедших тиков. Стоимость очистки пропорциональна
+    числу истекших ключей, а не размеру хранилища.
+    """
+
+    def __init__(self, slots: int = 1024, resolution: float = 1.0):
+        self.resolution = resolution
+        self._slots = [{} for _ in range(slots)]
+        self._tick = int(time.monotonic() / resolution)
+
+    def schedule(self, key, expires_at: float) -> None:
+        tick = int(expires_at / self.resolution)
+        # Ключ, переставленный на новый срок, может остаться и в старом слоте –
+        # владелец сверяет реальный срок записи, прежде чем ее удалить.
+        self._slots[tick % len(self._slots)][key] = tick
+
+    def advance(self, now: float):
+        """
+        Возвращает ключи, чей тик истечения уже прошел.
+        """
+        target = int(now / self.resolution)
+        if target <= self._tick:
+            return []
+        expired = []
+        count = min(target - self._tick, len(self._slots))
+        for tick in range(self._tick, self._tick + count):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            for key, key_tick in list(slot.items()):
+                # Ключи со сроком больше одного оборота колеса ждут следующего прохода.
+                if key_tick < target:
+                    del slot[key]
+                    expired.append(key)
+        self._tick = target
+        return expired
+
+
+class MemoryStateStore:
+    """
+    Состояние модерации в памяти процесса: кулдауны и ожидающие тесты с TTL.
+    Записи компактные (время истечения или кортеж), истекшие удаляются колесом таймеров
+    при каждом обращении, так что память не растет с числом когда-либо виденных пользователей.
+    """
+
+    def __init__(self, cooldown_seconds: float, pending_test_ttl: float):
+        self.cooldown_seconds = cooldown_seconds
+        self.pending_test_ttl = pending_test_ttl
+        self._user_cooldowns = {}  # user_id -> expires_at
+        self._chat_cooldowns = {}  # chat_id -> expires_at
+        self._pending_tests = {}   # (chat_id, user_id) -> (expires_at, expected)
+        self._tables = {"u": self._user_cooldowns, "c": self._chat_cooldowns, "p": self._pending_tests}
+        self._wheel = TimingWheel()
+        self.reaped_tests = 0
+
+    def _reap(self, now: float) -> None:
+        for kind, ident in self._wheel.advance(now):
+            table = self._tables[kind]
+            record = table.get(ident)
+            if record is None:
+                continue
+            expires_at = record[0] if kind == "p" else record
+            if expires_at <= now:
+                del table[ident]
+                if kind == "p":
+                    self.reaped_tests += 1
+
+    def _active(self, table: dict, ident, now: float) -> bool:
+        expires_at = table.get(ident)
+        return expires_at is not None and expires_at > now
+
+    async def should_warn(self, user_id: int, chat_id: int) -> bool:
+        now = time.monotonic()
+        self._reap(now)
+        return not (self._active(self._user_cooldowns, user_id, now) or
+                    self._active(self._chat_cooldowns, chat_id, now))
+
+    async def is_chat_cooling_down(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        self._reap(now)
+        return self._active(self._chat_cooldowns, chat_id, now)
+
+    async def mark_warned(self, user_id: int, chat_id: int) -> None:
+        now = time.monotonic()
+        self._reap(now)
+        expires_at = now + self.cooldown_seconds
+        self._user_cooldowns[user_id] = expires_at
+        self._chat_cooldowns[chat_id] = expires_at
+        self._wheel.schedule(("u", user_id), expires_at)
+        self._wheel.schedule(("c", chat_id), expires_at)
+
+    async def claim_warning(self, user_id: int, chat_id: int) -> bool:
+        # Внутри одного event loop между проверкой и записью нет await, поэтому операция атомарна.
+        if not await self.should_warn(user_id, chat_id):
+            return False
+        await self.mark_warned(user_id, chat_id)
+        return True
+
+    async def set_pending_test(self, chat_id: int, user_id: int, expected: str) -> None:
+        now = time.monotonic()
+        self._reap(now)
+        expires_at = now + self.pending_test_ttl
+        self._pending_tests[(chat_id, user_id)] = (expires_at, expected)
+        self._wheel.schedule(("p", (chat_id, user_id)), expires_at)
+
+    async def get_pending_test(self, chat_id: int, user_id: int) -> Optional[str]:
+        now = time.monotonic()
+        self._reap(now)
+        record = self._pending_tests.get((chat_id, user_id))
+        if record is None or record[0] <= now:
+            return None
+        return record[1]
+
+    async def pop_pending_test(self, chat_id: int, user_id: int) -> Optional[str]:
+        now = time.monotonic()
+        self._reap(now)
+        record = self._pending_tests.pop((chat_id, user_id), None)
+        if record is None or record[0] <= now:
+            return None
+        return record[1]
+
+    async def refresh_sizes(self) -> None:
+        # Размеры в памяти всегда актуальны; метод нужен для общего интерфейса с RedisStateStore.
+        pass
+
+    def sizes(self) -> dict:
+        return {
+            "pending_tests": len(self._pending_tests),
+            "user_cooldowns": len(self._user_cooldowns),
+            "chat_cooldowns": len(self._chat_cooldowns),
+        }
+
+
+# Атомарная проверка и установка кулдауна пользователя и чата (с записью в индексы сроков, см. sizes).
+_CLAIM_WARNING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], '1', 'EX', ARGV[1])
+redis.call('SET', KEYS[2], '1', 'EX', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[2], KEYS[1])
+redis.call('ZADD', KEYS[4], ARGV[2], KEYS[2])
+return 1
+"""
+
+
+class RedisStateStore:
+    """
+    Общее для всех воркеров и узлов состояние в Redis (через app/services/cache.py).
+    Истечение кулдаунов и тестов обеспечивает TTL самого Redis; проверка с установкой
+    кулдауна выполняется Lua-скриптом, ответ на тест забирается атомарным GETDEL.
+    Для метрик рядом ведутся индексы сроков (sorted set: ключ -> время истечения), так что размеры
+    состояния считаются ZCARD, без обхода всех ключей. Истекшие записи вычищаются из индекса
+    при каждой записи в него, поэтому он не растет и без scrape.
+    """
+
+    def __init__(self, cooldown_seconds: float, pending_test_ttl: float, prefix: str = "police"):
+        self.cooldown_seconds = int(cooldown_seconds)
+        self.pending_test_ttl = int(pending_test_ttl)
+        self.prefix = prefix
+        self._claim_script = None
+        self._index_keys = {
+            "pending_tests": f"{prefix}:index:pending",
+            "user_cooldowns": f"{prefix}:index:cooldown:user",
+            "chat_cooldowns": f"{prefix}:index:cooldown:chat",
+        }
+        self._sizes = {}
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self.prefix}:cooldown:user:{user_id}"
+
+    def _chat_key(self, chat_id: int) -> str:
+        return f"{self.prefix}:cooldown:chat:{chat_id}"
+
+    def _test_key(self, chat_id: int, user_id: int) -> str:
+        return f"{self.prefix}:pending:{chat_id}:{user_id}"
+
+    async def should_warn(self, user_id: int, chat_id: int) -> bool:
+        return not await cache.redis_client.exists(self._user_key(user_id), self._chat_key(chat_id))
+
+    async def is_chat_cooling_down(self, chat_id: int) -> bool:
+        return bool(await cache.redis_client.exists(self._chat_key(chat_id)))
+
+    async def mark_warned(self, user_id: int, chat_id: int) -> None:
+        now = time.time()
+        expires_at = now + self.cooldown_seconds
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(self._user_key(user_id), "1", ex=self.cooldown_seconds)
+            pipe.set(self._chat_key(chat_id), "1", ex=self.cooldown_seconds)
+            pipe.zremrangebyscore(self._index_keys["user_cooldowns"], "-inf", now)
+            pipe.zremrangebyscore(self._index_keys["chat_cooldowns"], "-inf", now)
+            pipe.zadd(self._index_keys["user_cooldowns"], {self._user_key(user_id): expires_at})
+            pipe.zadd(self._index_keys["chat_cooldowns"], {self._chat_key(chat_id): expires_at})
+            await pipe.execute()
+
+    async def claim_warning(self, user_id: int, chat_id: int) -> bool:
+        if self._claim_script is None:
+            self._claim_script = cache.redis_client.register_script(_CLAIM_WARNING_SCRIPT)
+        now = time.time()
+        claimed = await self._claim_script(
+            keys=[self._user_key(user_id), self._chat_key(chat_id),
+                  self._index_keys["user_cooldowns"], self._index_keys["chat_cooldowns"]],
+            args=[self.cooldown_seconds, now + self.cooldown_seconds, now],
+        )
+        return bool(int(claimed))
+
+    async def set_pending_test(self, chat_id: int, user_id: int, expected: str) -> None:
+        key = self._test_key(chat_id, user_id)
+        now = time.time()
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(key, expected, ex=self.pending_test_ttl)
+            pipe.zremrangebyscore(self._index_keys["pending_tests"], "-inf", now)
+            pipe.zadd(self._index_keys["pending_tests"], {key: now + self.pending_test_ttl})
+            await pipe.execute()
+
+    async def get_pending_test(self, chat_id: int, user_id: int) -> Optional[str]:
+        return await cache.redis_client.get(self._test_key(chat_id, user_id))
+
+    async def pop_pending_test(self, chat_id: int, user_id: int) -> Optional[str]:
+        key = self._test_key(chat_id, user_id)
+        async with cache.redis_client.pipeline(transaction=True) as pipe:
+            pipe.getdel(key)
+            pipe.zrem(self._index_keys["pending_tests"], key)
+            expected, _ = await pipe.execute()
+        return expected
+
+    async def refresh_sizes(self) -> None:
+        """
+        Пересчитывает размеры общего состояния по индексам сроков (вызывается перед scrape /metrics):
+        истекшие записи вычищаются из индексов, остальные считаются ZCARD.
+        """
+        now = time.time()
+        async with cache.redis_client.pipeline(transaction=False) as pipe:
+            for index_key in self._index_keys.values():
+                pipe.zremrangebyscore(index_key, "-inf", now)
+                pipe.zcard(index_key)
+            results = await pipe.execute()
+        self._sizes = {name: int(count) for name, count in zip(self._index_keys, results[1::2])}
+
+    def sizes(self) -> dict:
+        # Снимок последнего refresh_sizes(); до первого – пусто.
+        return self._sizes
+
+
+def create_state_store(cooldown_seconds: float, pending_test_ttl: float = None):
+    """
+    Создает хранилище состояния модерации согласно Config.STATE_BACKEND ("memory" или "redis").
+    """
+    pending_test_ttl = pending_test_ttl if pending_test_ttl is not None else Config.PENDING_TEST_TTL
+    if Config.STATE_BACKEND == "redis":
+        return RedisStateStore(cooldown_seconds, pending_test_ttl)
+    if Config.STATE_BACKEND != "memory":
+        logger.error(f"Неизвестный STATE_BACKEND={Config.STATE_BACKEND!r}; используется хранилище в памяти.")
+    return MemoryStateStore(cooldown_seconds, pending_test_ttl)
@@ -1,27 +1,246 @@
-from fastapi import FastAPI
+import asyncio
+import hmac
+import logging
+import time
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from telegram import Update
 from telegram.ext import Application
 from app.core.bot import PoliceBot
-from app.services.cache import init_redis
+from app.config import Config
+from app.core.learning import close_training_log
+from app.services.cache import init_redis, ping_redis
+from app.services import profiling
+from app.services.metrics import register_bot_collector, render_metrics
+from app.services.webhook import UpdateDeduplicator, register_webhook
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+def check_deployment() -> None:
+    """
+    Отказ стартовать в конфигурациях, где бот молча работал бы неправильно.
+    """
+    if Config.TELEGRAM_MODE == "webhook" and not Config.WEBHOOK_SECRET:
+        # Без секрета кто угодно может прислать поддельное обновление и замутить участника.
+        raise RuntimeError("TELEGRAM_MODE=webhook требует WEBHOOK_SECRET.")
+    if Config.WEB_CONCURRENCY <= 1:
+        return
+    if Config.TELEGRAM_MODE != "webhook":
+        raise RuntimeError("Несколько воркеров (WEB_CONCURRENCY > 1) возможны только в режиме webhook.")
+    if Config.STATE_BACKEND != "redis":
+        # Обновления одного пользователя попадают в разные воркеры: тесты и кулдауны должны быть общими.
+        raise RuntimeError("Несколько воркеров требуют STATE_BACKEND=redis.")
+    if not Config.PROMETHEUS_MULTIPROC_DIR:
+        raise RuntimeError("Несколько воркеров требуют PROMETHEUS_MULTIPROC_DIR для общих метрик.")
+    logger.warning(
+        "Несколько воркеров: порядок обработки обновлений одного пользователя гарантирован "
+        "только внутри воркера; тесты и кулдауны общие через Redis."
+    )
+
+async def load_model(bot: PoliceBot) -> None:
+    # Загрузка и прогрев модели идут в фоне, пока HTTP-сервер и polling уже работают
+    started = time.perf_counter()
+    try:
+        await bot.nlp.load()
+    except Exception as ex:
+        # Сообщения до загрузки модели не ждут ее, а пропускаются; загрузку повторяет наблюдатель ниже.
+        logger.error(f"Не удалось загрузить модель, повтор в фоне: {ex}")
+    else:
+        timings = ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in bot.nlp.load_timings.items())
+        logger.info(f"Модель готова за {time.perf_counter() - started:.2f}s ({timings})")
+    # Следим за manifest.json: новая версия модели подгружается и подменяется без рестарта
+    bot.nlp.start_watcher()
+
 @app.on_event("startup")
 async def startup():
+    check_deployment()
+    timings = {}
+    phase_start = time.perf_counter()
     await init_redis()
+    timings["redis"] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
     bot = PoliceBot()
+    app.police_bot = bot
+    register_bot_collector(bot)
+    app.model_task = asyncio.create_task(load_model(bot))
+    timings["bot"] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
     app.telegram_app = await bot.create_app()
     await app.telegram_app.initialize()
     await app.telegram_app.start()
-    # Запускаем получение обновлений (polling)
-    await app.telegram_app.updater.start_polling()
+    if Config.TELEGRAM_MODE == "webhook":
+        # Обновления приходят в POST Config.WEBHOOK_PATH и кладутся в очередь приложения
+        app.update_dedup = UpdateDeduplicator()
+        await register_webhook(app.telegram_app)
+    else:
+        # Запускаем получение обновлений (polling)
+        # chat_member не приходят без явного allowed_updates, а по ним сбрасывается кэш участников
+        await app.telegram_app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    timings["telegram"] = time.perf_counter() - phase_start
+
+    logger.info("Старт приложения: " + ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in timings.items()))
 
 @app.on_event("shutdown")
 async def shutdown():
     # Останавливаем polling при отключении приложения
-    await app.telegram_app.updater.stop()
+    if app.telegram_app.updater.running:
+        await app.telegram_app.updater.stop()
     await app.telegram_app.stop()
     await app.telegram_app.shutdown()
+    app.model_task.cancel()
+    await app.police_bot.nlp.close()
+    await app.police_bot.voice.close()
+    await app.police_bot.outbound.close()
+    # Дописываем буфер журнала обучающих данных, не блокируя event loop
+    await asyncio.to_thread(close_training_log)
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    bot = getattr(app, "police_bot", None)
+    if bot is not None:
+        try:
+            await bot.state.refresh_sizes()
+        except Exception as ex:
+            logger.warning(f"Не удалось обновить размеры состояния для /metrics: {ex}")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/ready")
+async def readiness_check():
+    # Готовность = модель загружена и Telegram принимает обновления; Redis только отражается в ответе,
+    # так как без него бот работает (кэш вердиктов остается локальным).
+    bot = getattr(app, "police_bot", None)
+    telegram_app = getattr(app, "telegram_app", None)
+    checks = {
+        "model": bool(bot and bot.nlp.is_ready),
+        "redis": await ping_redis(),
+        "telegram": bool(telegram_app and telegram_app.running and
+                         (Config.TELEGRAM_MODE == "webhook" or telegram_app.updater.running)),
+    }
+    ready = checks["model"] and checks["telegram"]
+    body = {"status": "ready" if ready else "starting", "checks": checks}
+    if bot and bot.nlp.is_ready:
+        body["model_version"] = bot.nlp.model_version
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.post(Config.WEBHOOK_PATH)
+async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: str = Header("")):
+    if Config.TELEGRAM_MODE != "webhook":
+        raise HTTPException(status_code=404)
+    # Пустой секрет в режиме webhook не дает стартовать (check_deployment), но проверка не зависит от этого.
+    # Байты, а не str: compare_digest падает с TypeError на не-ASCII строках, и клиент получил бы 500.
+    if not Config.WEBHOOK_SECRET or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token.encode("utf-8"), Config.WEBHOOK_SECRET.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403)
+    update = Update.de_json(await request.json(), app.telegram_app.bot)
+    # Повторные доставки подтверждаем, но не обрабатываем
+    if update is not None and await app.update_dedup.first_seen(update.update_id):
+        await app.telegram_app.update_queue.put(update)
+    return Response(status_code=200)
+
+@app.get("/cache/stats")
+async def cache_stats(x_admin_token: str = Header("")):
+    # Счетчики кэша вердиктов для подбора его размера.
+    require_admin(x_admin_token)
+    return app.police_bot.verdicts.stats()
+
+@app.get("/prefilter/stats")
+async def prefilter_stats(x_admin_token: str = Header("")):
+    # Доля трафика, разрешенная каждой ступенью каскада.
+    require_admin(x_admin_token)
+    prefilter = app.police_bot.prefilter
+    return prefilter.stats() if prefilter else {"enabled": False}
+
+def require_admin(token: str) -> None:
+    if not Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    # Как и секрет webhook, сравниваем байты: не-ASCII токен должен давать 403, а не 500.
+    if not hmac.compare_digest(token.encode("utf-8"), Config.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403)
+
+def require_profiling(token: str) -> None:
+    require_admin(token)
+    if not Config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404)
+
+@app.post("/admin/profile")
+async def profile(seconds: float = 10.0, mode: str = "sample", x_admin_token: str = Header("")):
+    # sample – стеки всех потоков в collapsed-формате (flamegraph.pl, speedscope); cprofile – pstats event loop.
+    require_profiling(x_admin_token)
+    if not 0 < seconds <= 60:
+        raise HTTPException(status_code=422, detail="seconds: от 0 до 60.")
+    try:
+        if mode == "sample":
+            report = await asyncio.to_thread(profiling.sample_stacks, seconds)
+        elif mode == "cprofile":
+            report = await profiling.profile_event_loop(seconds)
+        else:
+            raise HTTPException(status_code=422, detail="mode: sample или cprofile.")
+    except RuntimeError as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+    return PlainTextResponse(report)
+
+@app.get("/admin/tasks")
+async def asyncio_tasks(x_admin_token: str = Header("")):
+    require_profiling(x_admin_token)
+    return PlainTextResponse(profiling.dump_tasks())
+
+@app.get("/admin/timings")
+async def stage_timings(last: int = 50, x_admin_token: str = Header("")):
+    # Настройки потоков и поэтапные времена последних сообщений (в секундах).
+    require_profiling(x_admin_token)
+    last = max(last, 0)
+    return {
+        "threads": profiling.thread_settings(),
+        "messages": list(profiling.RECENT_MESSAGES)[-last:] if last else [],
+        "log_writes": list(profiling.RECENT_LOG_WRITES)[-last:] if last else [],
+    }
+
+@app.get("/admin/updates")
+async def update_queues(x_admin_token: str = Header("")):
+    # Глубина очередей обновлений и время ожидания по самым нагруженным (chat_id, user_id).
+    require_admin(x_admin_token)
+    return app.police_bot.updates.stats()
+
+@app.get("/admin/model")
+async def model_status(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    nlp = app.police_bot.nlp
+    return {
+        "active": nlp.model_version,
+        # Своя модель воркера; при работающем сервере инференса она загружается только как запасная.
+        "local": nlp.active.version if nlp.active else None,
+        "previous": nlp.previous.version if nlp.previous else None,
+        "inference_server": nlp.remote.path if nlp.remote_ready else None,
+    }
+
+def require_local_model() -> None:
+    # Версией модели на сервере инференса управляет он сам (следит за manifest.json).
+    if app.police_bot.nlp.remote_ready:
+        raise HTTPException(status_code=409, detail="Модель обслуживает сервер инференса.")
+
+@app.post("/admin/model/reload")
+async def model_reload(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    require_local_model()
+    reloaded = await app.police_bot.nlp.reload(force=True)
+    return {"reloaded": reloaded, "active": app.police_bot.nlp.model_version}
+
+@app.post("/admin/model/rollback")
+async def model_rollback(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    # Откат идет через manifest.json: остальные воркеры и сервер инференса переключаются
+    # при следующей проверке (MODEL_RELOAD_INTERVAL), этот процесс – сразу.
+    version = await app.police_bot.nlp.rollback()
+    if version is False:
+        raise HTTPException(status_code=409, detail="Нет предыдущей версии модели.")
+    return {"published": version or Config.MODEL_PATH, "active": app.police_bot.nlp.model_version}
@@ -1,5 +1,6 @@
 # расположен в: police-bot-prod/app/services/cache.py
 
+import asyncio
 from redis import asyncio as aioredis
 from app.config import Config
 
@@ -9,6 +10,14 @@ async def init_redis():
     global redis_client
     redis_client = await aioredis.from_url(Config.REDIS_URL, decode_responses=True)
 
+async def ping_redis(timeout=1.0) -> bool:
+    if redis_client is None:
+        return False
+    try:
+        return bool(await asyncio.wait_for(redis_client.ping(), timeout))
+    except Exception:
+        return False
+
 async def get_cache(key):
     return await redis_client.get(key)
 
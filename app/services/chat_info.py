@@ -0,0 +1,116 @@
+# расположен в: police-bot-prod/app/services/chat_info.py
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import Config
+from app.services import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ChatInfoCache:
+    """
+    Кэш метаданных для мута: тип чата и статус участника (creator, administrator, member...).
+    Как и кэш вердиктов – локальный LRU с TTL и Redis за ним. Обновления chat_member
+    записывают новый статус сразу, переход группы в супергруппу и удаление бота из чата сбрасывают
+    тип чата, поэтому TTL нужен только на случай пропущенных обновлений.
+    Локальный TTL короткий: другие воркеры видят изменение через Redis не позже, чем через него.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None, redis_ttl: int = None):
+        self.max_size = max_size if max_size is not None else Config.CHAT_INFO_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else Config.CHAT_INFO_TTL
+        self.redis_ttl = redis_ttl if redis_ttl is not None else Config.CHAT_INFO_REDIS_TTL
+        # key -> (expires_at, value); порядок элементов – порядок последнего обращения.
+        self._local = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _chat_key(chat_id: int) -> str:
+        return f"police:chat:{chat_id}:type"
+
+    @staticmethod
+    def _member_key(chat_id: int, user_id: int) -> str:
+        return f"police:chat:{chat_id}:member:{user_id}"
+
+    async def chat_type(self, bot, chat_id: int) -> str:
+        key = self._chat_key(chat_id)
+        value = await self._get(key)
+        if value is None:
+            chat = await bot.get_chat(chat_id)
+            value = chat.type
+            await self._set(key, value)
+        return value
+
+    async def member_status(self, bot, chat_id: int, user_id: int) -> str:
+        key = self._member_key(chat_id, user_id)
+        value = await self._get(key)
+        if value is None:
+            member = await bot.get_chat_member(chat_id, user_id)
+            value = member.status
+            await self._set(key, value)
+        return value
+
+    async def remember_chat(self, chat_id: int, chat_type: str) -> None:
+        await self._set(self._chat_key(chat_id), chat_type)
+
+    async def remember_member(self, chat_id: int, user_id: int, status: str) -> None:
+        await self._set(self._member_key(chat_id, user_id), status)
+
+    async def invalidate_chat(self, chat_id: int) -> None:
+        await self._delete(self._chat_key(chat_id))
+
+    async def _get(self, key: str) -> Optional[str]:
+        entry = self._local.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._local[key]
+
+        try:
+            value = await cache.get_cache(key)
+        except Exception as ex:
+            logger.debug(f"Redis недоступен для кэша метаданных чатов: {ex}")
+            value = None
+        if value is not None:
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    async def _set(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        try:
+            await cache.set_cache(key, value, expire=self.redis_ttl)
+        except Exception as ex:
+            logger.debug(f"Не удалось сохранить метаданные чата в Redis: {ex}")
+
+    async def _delete(self, key: str) -> None:
+        self._local.pop(key, None)
+        try:
+            await cache.redis_client.delete(key)
+        except Exception as ex:
+            logger.debug(f"Не удалось удалить метаданные чата из Redis: {ex}")
+
+    def _remember(self, key: str, value: str) -> None:
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._local),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,172 @@
+"""
+Export / quantize the toxicity classifier for the faster CPU backends and check parity with fp32.
+Works for both the base model and the fine-tuned one:
+    python -m app.services.export_model --source cointegrated/rubert-tiny-toxicity --backend onnx
+    python -m app.services.export_model --source app/models/fine_tuned_model/<version> --backend torch-int8
+Without --source the model version the bot currently serves is used.
+"onnx" exports an ONNX graph into ONNX_MODEL_DIR; "torch-int8" is quantized at load time, so for it
+the command only runs the parity check. The parity check scores a sample set with fp32 and with the
+selected backend and compares toxicity scores and flag decisions; the command exits with a non-zero
+status if more flags flip than allowed.
+Run it again after every fine-tuning run when the bot uses the ONNX backend.
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import torch
+from transformers import AutoTokenizer
+
+from app.core.backends import BACKENDS, load_backend, load_torch_model, onnx_model_path
+from app.core.learning import iter_training_data
+from app.core.model_registry import resolve_model_source
+from app.core.nlp import TOXICITY_THRESHOLD
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Used when neither --samples nor the training log provide enough texts.
+DEFAULT_SAMPLES = [
+    "Привет, как дела?",
+    "Спасибо, все отлично!",
+    "Ты полный идиот и ничего не понимаешь",
+    "Встречаемся завтра в 10 у входа",
+    "Заткнись уже, надоел",
+    "Отличная идея, давайте так и сделаем",
+    "Я тебя найду и тебе не поздоровится",
+    "Кто-нибудь видел мои ключи?",
+]
+
+# BERT forward() takes its inputs in this order.
+_ONNX_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            return_dict=True,
+        ).logits
+
+
+def export_onnx(source: str, opset: int = 14) -> str:
+    """
+    Export the fp32 model to an ONNX graph with dynamic batch and sequence axes.
+    """
+    model = load_torch_model(source)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    dummy = tokenizer(["пример текста для экспорта"], return_tensors="pt")
+    input_names = [name for name in _ONNX_INPUTS if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    path = onnx_model_path(source)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    torch.onnx.export(
+        _LogitsOnly(model),
+        tuple(dummy[name] for name in input_names),
+        path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+    )
+    logger.info(f"Exported {source} to {path}")
+    return path
+
+
+def load_samples(samples_file=None, limit=500):
+    if samples_file:
+        with open(samples_file, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()][:limit]
+    texts = []
+    for entry in iter_training_data():
+        if entry.get("text"):
+            texts.append(entry["text"])
+            if len(texts) >= limit:
+                break
+    return texts or list(DEFAULT_SAMPLES)
+
+
+def _score_all(backend, tokenizer, texts, batch_size):
+    scores = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(
+            texts[i:i + batch_size],
+            return_tensors=backend.tensor_type,
+            truncation=True,
+            max_length=512,
+            padding=True,
+        )
+        scores.extend(backend.scores(inputs))
+    return scores, time.perf_counter() - start
+
+
+def parity_check(kind: str, source: str, texts, batch_size: int = 16) -> dict:
+    """
+    Compare toxicity scores and flag decisions of the given backend against fp32 PyTorch.
+    """
+    reference, tokenizer = load_backend("torch", source)
+    candidate, _ = load_backend(kind, source)
+    if candidate.name != kind:
+        raise RuntimeError(f"Backend {kind} could not be loaded (got {candidate.name}).")
+
+    ref_scores, ref_time = _score_all(reference, tokenizer, texts, batch_size)
+    cand_scores, cand_time = _score_all(candidate, tokenizer, texts, batch_size)
+    diffs = [abs(r - c) for r, c in zip(ref_scores, cand_scores)]
+    flips = [
+        text for text, r, c in zip(texts, ref_scores, cand_scores)
+        if (r >= TOXICITY_THRESHOLD) != (c >= TOXICITY_THRESHOLD)
+    ]
+    return {
+        "backend": kind,
+        "source": source,
+        "samples": len(texts),
+        "max_abs_diff": max(diffs) if diffs else 0.0,
+        "mean_abs_diff": sum(diffs) / len(diffs) if diffs else 0.0,
+        "flag_mismatches": len(flips),
+        "mismatched_texts": flips[:10],
+        "fp32_ms_per_message": 1000 * ref_time / max(len(texts), 1),
+        "candidate_ms_per_message": 1000 * cand_time / max(len(texts), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="Hub id or local model directory (default: the model the bot loads)")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "torch"], default="onnx")
+    parser.add_argument("--samples", default=None, help="Text file with one sample message per line")
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--max-flag-mismatches", type=int, default=0)
+    parser.add_argument("--skip-parity", action="store_true")
+    args = parser.parse_args(argv)
+
+    source = args.source or resolve_model_source()[0]
+    if args.backend == "onnx":
+        export_onnx(source)
+    if args.skip_parity:
+        return 0
+
+    report = parity_check(args.backend, source, load_samples(args.samples, args.limit))
+    for key, value in report.items():
+        logger.info(f"{key}: {value}")
+    if report["flag_mismatches"] > args.max_flag_mismatches:
+        logger.error(f"Parity check failed: {report['flag_mismatches']} flag decisions differ from fp32.")
+        return 1
+    logger.info("Parity check passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
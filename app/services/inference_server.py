@@ -0,0 +1,139 @@
+"""
+Shared inference server: loads the toxicity model once and scores texts for every gunicorn worker
+over a Unix socket, instead of each worker keeping its own model copy and torch thread pool.
+    INFERENCE_SOCKET=/run/police/inference.sock python -m app.services.inference_server
+Workers started with the same INFERENCE_SOCKET send their texts here (see InferenceClient in
+app/core/nlp.py for the framing); requests from all workers go through one MicroBatcher, so
+concurrent messages still share forward passes. The server follows manifest.json like a worker
+does. If it is down, workers load the model themselves and reconnect once it is back.
+INFERENCE_SERVER_CPUS pins the process (and torch's intra-op threads) to the given cores,
+leaving the rest to the web workers.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from app.config import Config
+from app.core.nlp import NLPProcessor, encode_frame, read_frame
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_cpus(spec: str) -> set:
+    """
+    "0-3,6" -> {0, 1, 2, 3, 6}
+    """
+    cpus = set()
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def pin_cpus(spec: str) -> None:
+    # Must run before the backend is loaded: torch sizes its thread pool on first use.
+    cpus = parse_cpus(spec)
+    if not cpus:
+        return
+    os.sched_setaffinity(0, cpus)
+    if Config.NLP_INTRA_OP_THREADS <= 0:
+        Config.NLP_INTRA_OP_THREADS = len(cpus)
+    logger.info(f"Pinned to CPUs {sorted(cpus)} with {Config.NLP_INTRA_OP_THREADS} intra-op threads")
+
+
+class InferenceServer:
+    def __init__(self, nlp: NLPProcessor, path: str):
+        self.nlp = nlp
+        self.path = path
+        self._server = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            # Left over from a previous run that did not shut down cleanly.
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        os.chmod(self.path, 0o660)
+        logger.info(f"Serving model {self.nlp.model_version} on {self.path}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Frames are answered as soon as they are scored, not in order; the client matches them by id.
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                message = await read_frame(reader)
+                task = asyncio.create_task(self._answer(message, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as ex:
+            if not isinstance(ex, asyncio.IncompleteReadError) or ex.partial:
+                logger.warning(f"Dropping inference client: {ex}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _answer(self, message: dict, writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        response = {"id": message.get("id")}
+        try:
+            if message.get("op") == "hello":
+                await self.nlp.wait_ready()
+                response["version"] = self.nlp.model_version
+            else:
+                scored = await asyncio.gather(*(self.nlp.batcher.submit(text) for text in message["texts"]))
+                response["results"] = [[score, version, window] for score, version, window, _ in scored]
+        except Exception as ex:
+            logger.error(f"Failed to score request {response['id']}: {ex}")
+            response["error"] = str(ex)
+        async with write_lock:
+            writer.write(encode_frame(response))
+            try:
+                await writer.drain()
+            except OSError:
+                pass
+
+
+async def serve(path: str) -> None:
+    nlp = NLPProcessor(remote_path="")
+    await nlp.load()
+    nlp.start_watcher()
+    server = InferenceServer(nlp, path)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Shutting down inference server")
+        await server.close()
+        await nlp.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=Config.INFERENCE_SOCKET or "/run/police/inference.sock")
+    parser.add_argument("--cpus", default=Config.INFERENCE_SERVER_CPUS, help='Cores to pin to, e.g. "0-3"')
+    args = parser.parse_args()
+    pin_cpus(args.cpus)
+    asyncio.run(serve(args.socket))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,192 @@
+# расположен в: police-bot-prod/app/services/metrics.py
+
+import functools
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.config import Config
+
+# Все метрики с лейблами привязываются заранее: на горячем пути нет ни форматирования
+# лейблов, ни поиска в словаре дочерних метрик, только observe()/inc() у готового объекта.
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HANDLER_LATENCY = Histogram(
+    "police_handler_latency_seconds", "Время обработки обновления хендлером", ["handler"],
+    buckets=_LATENCY_BUCKETS,
+)
+HANDLE_TEXT_LATENCY = HANDLER_LATENCY.labels("handle_text")
+HANDLE_VOICE_LATENCY = HANDLER_LATENCY.labels("handle_voice")
+HANDLE_FEEDBACK_LATENCY = HANDLER_LATENCY.labels("handle_feedback_callback")
+
+TOKENIZE_SECONDS = Histogram(
+    "police_nlp_tokenize_seconds", "Время токенизации батча", buckets=_LATENCY_BUCKETS,
+)
+FORWARD_SECONDS = Histogram(
+    "police_nlp_forward_seconds", "Время forward pass модели на батч", buckets=_LATENCY_BUCKETS,
+)
+WINDOWS = Counter("police_nlp_windows", "Окна длинных сообщений", ["result"])
+WINDOWS_SCORED = WINDOWS.labels("scored")
+WINDOWS_SKIPPED = WINDOWS.labels("skipped")  # не понадобились: сработало более раннее окно
+WINDOWS_CAPPED = WINDOWS.labels("capped")    # сверх NLP_MAX_WINDOWS
+BATCH_SIZE = Histogram(
+    "police_nlp_batch_size", "Число текстов в батче инференса", buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+UPDATE_QUEUE_WAIT = Histogram(
+    "police_update_queue_wait_seconds", "Ожидание обновления в очереди своего (chat_id, user_id)",
+    buckets=_LATENCY_BUCKETS,
+)
+
+ADMISSION = Counter("police_admission", "Решения стадии допуска обновлений", ["decision"])
+ADMITTED = ADMISSION.labels("admitted")
+SHED_STALE = ADMISSION.labels("shed_stale")
+SHED_COOLDOWN = ADMISSION.labels("shed_cooldown")
+SHED_VOICE = ADMISSION.labels("shed_voice_degraded")
+DEGRADED_SKIPPED = ADMISSION.labels("degraded_skipped")
+DEGRADED_SAMPLED = ADMISSION.labels("degraded_sampled")
+
+FLAGS = Counter("police_flags", "Сообщения, признанные подозрительными", ["source"])
+FLAGS_TEXT = FLAGS.labels("text")
+FLAGS_VOICE = FLAGS.labels("voice")
+TESTS = Counter("police_tests", "Результаты теста на трезвость", ["result"])
+TESTS_PASSED = TESTS.labels("passed")
+TESTS_FAILED = TESTS.labels("failed")
+MUTES = Counter("police_mutes", "Наложенные муты")
+TELEGRAM_ERRORS = Counter("police_telegram_api_errors", "Ошибки вызовов Telegram API")
+TELEGRAM_RETRY_AFTER = Counter("police_telegram_retry_after", "Ответы 429 (RetryAfter) от Telegram API")
+WEBHOOK_DUPLICATES = Counter("police_webhook_duplicate_updates", "Повторные доставки update_id")
+TRAINING_LOG_DROPPED = Counter("police_training_log_dropped", "Незаписанные записи журнала обучающих данных", ["reason"])
+TRAINING_LOG_DROPPED_QUEUE_FULL = TRAINING_LOG_DROPPED.labels("queue_full")
+TRAINING_LOG_DROPPED_WRITE_ERROR = TRAINING_LOG_DROPPED.labels("write_error")
+TRAINING_LOG_DROPPED_CLOSED = TRAINING_LOG_DROPPED.labels("closed")
+
+
+def observe_latency(histogram):
+    """
+    Декоратор асинхронного хендлера: время выполнения пишется в заранее привязанную гистограмму.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class StateCollector:
+    """
+    Размеры состояния модерации (ожидающие тесты, кулдауны). С STATE_BACKEND=redis они общие
+    для всех воркеров, поэтому отдаются и в multiprocess-режиме; снимок обновляет refresh_sizes().
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def collect(self):
+        sizes = self.state.sizes()
+        if sizes:
+            pending = GaugeMetricFamily("police_pending_tests", "Ожидающие ответа тесты")
+            pending.add_metric([], sizes["pending_tests"])
+            yield pending
+            cooldowns = GaugeMetricFamily("police_cooldown_entries", "Активные кулдауны", labels=["scope"])
+            cooldowns.add_metric(["user"], sizes["user_cooldowns"])
+            cooldowns.add_metric(["chat"], sizes["chat_cooldowns"])
+            yield cooldowns
+
+
+class BotStateCollector:
+    """
+    Гейджи и счетчики, которые уже ведутся в объектах бота (кэш вердиктов, очереди,
+    каскад предфильтрации), читаются только в момент scrape и ничего не стоят на горячем пути.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def collect(self):
+        stats = self.bot.verdicts.stats()
+        lookups = CounterMetricFamily("police_verdict_cache_lookups", "Обращения к кэшу вердиктов", labels=["result"])
+        lookups.add_metric(["hit_local"], stats["hits_local"])
+        lookups.add_metric(["hit_redis"], stats["hits_redis"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        evictions = CounterMetricFamily("police_verdict_cache_evictions", "Вытеснения из кэша вердиктов", labels=["reason"])
+        evictions.add_metric(["size"], stats["evictions_size"])
+        evictions.add_metric(["ttl"], stats["evictions_ttl"])
+        yield evictions
+        size = GaugeMetricFamily("police_verdict_cache_size", "Записей в локальном кэше вердиктов")
+        size.add_metric([], stats["size"])
+        yield size
+
+        updates = self.bot.updates.stats(top=0)
+        queued_updates = GaugeMetricFamily("police_updates_queued", "Обновления, ждущие своей очереди по ключу")
+        queued_updates.add_metric([], updates["queued"])
+        yield queued_updates
+        running_updates = GaugeMetricFamily("police_updates_running", "Обновления в обработке")
+        running_updates.add_metric([], updates["running"])
+        yield running_updates
+        degraded = GaugeMetricFamily("police_degraded_mode", "1, пока бот в деградированном режиме")
+        degraded.add_metric([], 1 if self.bot.admission.degraded else 0)
+        yield degraded
+
+        chat_info = self.bot.chat_info.stats()
+        chat_lookups = CounterMetricFamily(
+            "police_chat_info_cache_lookups", "Обращения к кэшу метаданных чатов", labels=["result"]
+        )
+        chat_lookups.add_metric(["hit"], chat_info["hits"])
+        chat_lookups.add_metric(["miss"], chat_info["misses"])
+        yield chat_lookups
+
+        outbound = self.bot.outbound.stats()
+        queued = GaugeMetricFamily("police_outbound_queued", "Исходящие вызовы Telegram в очереди")
+        queued.add_metric([], outbound["queued"])
+        yield queued
+        waiting = GaugeMetricFamily("police_outbound_chats_waiting", "Чаты, упершиеся в лимит исходящих вызовов")
+        waiting.add_metric([], outbound["chats_waiting"])
+        yield waiting
+
+        if self.bot.prefilter is not None:
+            resolved = CounterMetricFamily(
+                "police_prefilter_resolved", "Сообщения, разрешенные ступенью каскада", labels=["stage"]
+            )
+            for stage, count in self.bot.prefilter.resolved.items():
+                resolved.add_metric([stage], count)
+            yield resolved
+
+
+_state_collector = None
+
+
+def register_bot_collector(bot) -> None:
+    global _state_collector
+    _state_collector = StateCollector(bot.state)
+    REGISTRY.register(_state_collector)
+    REGISTRY.register(BotStateCollector(bot))
+
+
+def render_metrics():
+    if Config.PROMETHEUS_MULTIPROC_DIR:
+        # Счетчики и гистограммы всех воркеров суммируются из файлов PROMETHEUS_MULTIPROC_DIR.
+        # BotStateCollector сюда не входит: он видит только состояние отвечающего воркера,
+        # и его значения менялись бы от scrape к scrape. Размеры состояния берутся из Redis и общие.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        if _state_collector is not None:
+            registry.register(_state_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
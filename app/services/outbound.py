@@ -0,0 +1,255 @@
+# расположен в: police-bot-prod/app/services/outbound.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from app.config import Config
+from app.services import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем раньше уходит вызов: мут важнее предупреждения, предупреждение – ответа.
+PRIORITY_MUTE = 0
+PRIORITY_WARNING = 1
+PRIORITY_REPLY = 2
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше burst в запасе. rate <= 0 – без ограничения.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        Через сколько секунд будет доступен токен (0 – доступен сейчас).
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def pause(self, until: float) -> None:
+        self.paused_until = max(self.paused_until, until)
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "func", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, priority, seq, chat_id, func, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """
+    Очередь исходящих вызовов Telegram с лимитами на бота и на каждый чат.
+    Вызов ставится в очередь чата со своим приоритетом; диспетчер отправляет первым вызов
+    с наивысшим приоритетом среди чатов, у которых есть токен, и только если есть глобальный токен.
+    На 429 (RetryAfter) чат приостанавливается на указанное Telegram время, и вызов
+    повторяется без потери места в очереди. Сам вызов выполняется отдельной задачей,
+    так что медленный ответ API не задерживает остальные чаты.
+    """
+
+    def __init__(self, global_rate: float = None, chat_rate: float = None, chat_burst: int = None,
+                 max_retries: int = None):
+        global_rate = global_rate if global_rate is not None else Config.OUTBOUND_GLOBAL_RATE
+        self.chat_rate = chat_rate if chat_rate is not None else Config.OUTBOUND_CHAT_RATE
+        self.chat_burst = chat_burst if chat_burst is not None else Config.OUTBOUND_CHAT_BURST
+        self.max_retries = max_retries if max_retries is not None else Config.OUTBOUND_MAX_RETRIES
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}   # chat_id -> TokenBucket
+        self.max_buckets = 10000
+        self._queues = {}    # chat_id -> куча _Job
+        self._ready = []     # куча (priority, seq, chat_id): чаты, чей первый вызов можно отправлять
+        self._waiting = []   # куча (ready_at, chat_id): чаты, ждущие токен
+        self._waiting_chats = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._inflight = set()
+        self.sent = 0
+        self.retried = 0
+
+    async def call(self, chat_id: int, priority: int, func, /, *args, **kwargs):
+        """
+        Ставит вызов func(*args, **kwargs) в очередь и ждет его результата (или исключения).
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter() if profiling.ENABLED else None
+        self._enqueue(_Job(priority, next(self._seq), chat_id, func, args, kwargs, future))
+        try:
+            return await future
+        finally:
+            if start is not None:
+                # Включает и ожидание токена: именно столько сообщение ждало отправки.
+                profiling.add("telegram_send", time.perf_counter() - start)
+
+    def _enqueue(self, job: _Job) -> None:
+        heapq.heappush(self._queues.setdefault(job.chat_id, []), job)
+        if job.chat_id not in self._waiting_chats:
+            heapq.heappush(self._ready, (job.priority, job.seq, job.chat_id))
+        self._wakeup.set()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _promote_waiting(self, now: float) -> None:
+        """
+        Возвращает в кучу готовых чаты, дождавшиеся токена.
+        """
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            self._waiting_chats.discard(chat_id)
+            queue = self._queues.get(chat_id)
+            if queue:
+                heapq.heappush(self._ready, (queue[0].priority, queue[0].seq, chat_id))
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._promote_waiting(now)
+            job = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._waiting[0][0] - now if self._waiting else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            global_delay = self._global.delay(now)
+            if global_delay:
+                heapq.heappush(self._ready, (job.priority, job.seq, job.chat_id))
+                await asyncio.sleep(global_delay)
+                continue
+            heapq.heappop(self._queues[job.chat_id])
+            self._global.take()
+            self._bucket(job.chat_id).take()
+            self._after_dispatch(job.chat_id, now)
+            task = asyncio.create_task(self._run(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _next_job(self, now: float):
+        """
+        Снимает с кучи готовых чат с самым приоритетным вызовом; устаревшие записи пропускаются.
+        """
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._queues.get(chat_id)
+            if not queue or queue[0].seq != seq or chat_id in self._waiting_chats:
+                continue
+            delay = self._bucket(chat_id).delay(now)
+            if delay:
+                self._wait(chat_id, now + delay)
+                continue
+            return queue[0]
+        return None
+
+    def _after_dispatch(self, chat_id: int, now: float) -> None:
+        queue = self._queues[chat_id]
+        if not queue:
+            del self._queues[chat_id]
+            if len(self._buckets) > self.max_buckets:
+                self._prune_buckets(now)
+            return
+        delay = self._bucket(chat_id).delay(now)
+        if delay:
+            self._wait(chat_id, now + delay)
+        else:
+            heapq.heappush(self._ready, (queue[0].priority, queue[0].seq, chat_id))
+
+    def _prune_buckets(self, now: float) -> None:
+        # Ведро чата без очереди, успевшее наполниться до burst, ничем не отличается от нового.
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id in self._queues or now < bucket.paused_until:
+                continue
+            if bucket.rate <= 0 or bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[chat_id]
+
+    def _wait(self, chat_id: int, ready_at: float) -> None:
+        if chat_id not in self._waiting_chats:
+            self._waiting_chats.add(chat_id)
+            heapq.heappush(self._waiting, (ready_at, chat_id))
+
+    async def _run(self, job: _Job) -> None:
+        if job.future.done():
+            return
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as ex:
+            job.attempts += 1
+            metrics.TELEGRAM_RETRY_AFTER.inc()
+            retry_after = ex.retry_after
+            logger.warning(f"Telegram просит подождать {retry_after} с (чат {job.chat_id}).")
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(ex)
+                return
+            self.retried += 1
+            self._bucket(job.chat_id).pause(time.monotonic() + retry_after)
+            self._enqueue(job)
+        except Exception as ex:
+            if not job.future.done():
+                job.future.set_exception(ex)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue_depth(),
+            "chats_queued": len(self._queues),
+            "chats_waiting": len(self._waiting_chats),
+            "in_flight": len(self._inflight),
+            "sent": self.sent,
+            "retried": self.retried,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.cancel()
+        self._queues.clear()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
@@ -0,0 +1,135 @@
+# расположен в: police-bot-prod/app/services/profiling.py
+
+import asyncio
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from app.config import Config
+
+# Все хуки на горячем пути начинаются с проверки ENABLED: при выключенной диагностике
+# не создаются трассы и не пишутся кольцевые буферы.
+ENABLED = Config.PROFILING_ENABLED
+
+# Поэтапные времена последних PROFILE_HISTORY сообщений и пачек записи журнала обучающих данных.
+RECENT_MESSAGES = deque(maxlen=Config.PROFILE_HISTORY)
+RECENT_LOG_WRITES = deque(maxlen=Config.PROFILE_HISTORY)
+
+_trace = contextvars.ContextVar("police_trace", default=None)
+_profile_lock = threading.Lock()
+
+
+async def traced(name: str, func, *args, **kwargs):
+    """
+    Выполняет хендлер с трассой в contextvar; этапы внутри (токенизация, forward, отправка
+    в Telegram) добавляют в нее свое время, а готовая трасса попадает в RECENT_MESSAGES.
+    """
+    trace = {"handler": name, "started_at": time.time()}
+    token = _trace.set(trace)
+    start = time.perf_counter()
+    try:
+        return await func(*args, **kwargs)
+    finally:
+        trace["total"] = time.perf_counter() - start
+        _trace.reset(token)
+        RECENT_MESSAGES.append(trace)
+
+
+def add(stage: str, seconds: float) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+def record_log_write(entries: int, seconds: float) -> None:
+    # Журнал пишется фоновым потоком пачками, поэтому время записи привязано к пачке, а не к сообщению.
+    RECENT_LOG_WRITES.append({"finished_at": time.time(), "entries": entries, "log_write": seconds})
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    Статистический профайлер: раз в interval снимает стеки всех потоков (event loop, пулы
+    инференса и распознавания речи) и возвращает их в collapsed-формате для flamegraph.
+    Блокирует вызывающий поток – запускать через asyncio.to_thread.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Профилирование уже запущено.")
+    try:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+
+
+async def profile_event_loop(seconds: float, limit: int = 60) -> str:
+    """
+    cProfile потока event loop на seconds секунд; возвращает текстовый отчет pstats
+    (по суммарному времени). Потоки инференса cProfile не видит – для них sample_stacks.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Профилирование уже запущено.")
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _profile_lock.release()
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def dump_tasks() -> str:
+    """
+    Стеки всех задач asyncio текущего event loop (вызывать из него).
+    """
+    out = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    out.write(f"{len(tasks)} tasks\n")
+    for task in tasks:
+        out.write(f"\n{task!r}\n")
+        task.print_stack(limit=30, file=out)
+    return out.getvalue()
+
+
+def thread_settings() -> dict:
+    """
+    Настройки потоков инференса. torch не импортируется ради ответа: если модель еще не
+    загружена (или backend – onnx без torch), его настройки просто не показываются.
+    """
+    settings = {
+        "nlp_backend": Config.NLP_BACKEND,
+        "nlp_inference_threads": Config.NLP_INFERENCE_THREADS,
+        "nlp_intra_op_threads": Config.NLP_INTRA_OP_THREADS,
+        "stt_threads": Config.STT_THREADS,
+        "cpu_count": os.cpu_count(),
+    }
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        settings["torch_num_threads"] = torch.get_num_threads()
+        settings["torch_num_interop_threads"] = torch.get_num_interop_threads()
+    return settings
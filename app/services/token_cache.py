@@ -0,0 +1,136 @@
+"""
+On-disk cache of tokenized training texts for app/services/train_model.py.
+Token ids of every text are appended once to a flat int32 file and read back through a memory
+map, so epochs and later training runs do not tokenize anything again:
+
+    app/models/token_cache/<tokenizer fingerprint>/
+        tokens.bin    input_ids of all cached texts, back to back
+        index.npz     sha1(text) -> (offset, length) into tokens.bin
+
+The fingerprint covers the tokenizer class, its vocabulary, special tokens and max_length,
+so a different tokenizer gets its own cache instead of silently reusing stale ids.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+from torch.utils.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_DIR = "app/models/token_cache"
+_DIGEST_BYTES = 20
+
+
+def tokenizer_fingerprint(tokenizer, max_length: int) -> str:
+    state = {
+        "class": type(tokenizer).__name__,
+        "vocab": hashlib.sha1(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8")).hexdigest(),
+        "special_tokens": tokenizer.special_tokens_map,
+        "lowercase": getattr(tokenizer, "do_lower_case", None),
+        "max_length": max_length,
+    }
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def _text_digest(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class TokenCache:
+    def __init__(self, tokenizer, max_length: int = 512, root: str = TOKEN_CACHE_DIR):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.directory = os.path.join(root, tokenizer_fingerprint(tokenizer, max_length))
+        self.tokens_path = os.path.join(self.directory, "tokens.bin")
+        self.index_path = os.path.join(self.directory, "index.npz")
+        self._index = self._load_index()
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.index_path) or not os.path.exists(self.tokens_path):
+            return {}
+        with np.load(self.index_path) as data:
+            digests, offsets, lengths = data["digests"], data["offsets"], data["lengths"]
+        if digests.dtype.kind == "S":
+            # Older indexes stored digests as S20, which drops trailing NUL bytes; padding restores them.
+            digests = [bytes(d).ljust(_DIGEST_BYTES, b"\0") for d in digests]
+        else:
+            digests = [bytes(row) for row in digests]
+        # Tokens written after the last index update (an interrupted run) are simply ignored.
+        return {d: (int(o), int(n)) for d, o, n in zip(digests, offsets, lengths)}
+
+    def _save_index(self) -> None:
+        count = len(self._index)
+        # Raw uint8 rows: a fixed-width bytes dtype would strip digests that end in NUL.
+        digests = np.empty((count, _DIGEST_BYTES), dtype=np.uint8)
+        offsets = np.empty(count, dtype=np.int64)
+        lengths = np.empty(count, dtype=np.int32)
+        for i, (digest, (offset, length)) in enumerate(self._index.items()):
+            digests[i] = np.frombuffer(digest, dtype=np.uint8)
+            offsets[i], lengths[i] = offset, length
+        tmp_path = self.index_path + ".tmp.npz"
+        np.savez(tmp_path, digests=digests, offsets=offsets, lengths=lengths)
+        os.replace(tmp_path, self.index_path)
+
+    def encode(self, texts, batch_size: int = 1000):
+        """
+        Return (offsets, lengths) of every text, tokenizing only texts the cache has not seen.
+        """
+        digests = [_text_digest(text) for text in texts]
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in self._index:
+                missing.setdefault(digest, text)
+        if missing:
+            os.makedirs(self.directory, exist_ok=True)
+            items = list(missing.items())
+            with open(self.tokens_path, "ab") as f:
+                # Offsets are in tokens; the file may end with tokens of an interrupted run.
+                offset = f.seek(0, os.SEEK_END) // np.dtype(np.int32).itemsize
+                for i in range(0, len(items), batch_size):
+                    chunk = items[i:i + batch_size]
+                    encoded = self.tokenizer(
+                        [text for _, text in chunk], truncation=True, max_length=self.max_length,
+                    )["input_ids"]
+                    for (digest, _), ids in zip(chunk, encoded):
+                        np.asarray(ids, dtype=np.int32).tofile(f)
+                        self._index[digest] = (offset, len(ids))
+                        offset += len(ids)
+            self._save_index()
+            logger.info(f"Tokenized {len(missing)} new texts; {len(texts) - len(missing)} taken from the cache.")
+        located = [self._index[digest] for digest in digests]
+        offsets = np.fromiter((o for o, _ in located), dtype=np.int64, count=len(located))
+        lengths = np.fromiter((n for _, n in located), dtype=np.int32, count=len(located))
+        return offsets, lengths
+
+    def tokens(self) -> np.ndarray:
+        return np.memmap(self.tokens_path, dtype=np.int32, mode="r")
+
+    def dataset(self, texts, labels) -> "CachedTokenDataset":
+        offsets, lengths = self.encode(texts)
+        return CachedTokenDataset(self.tokens(), offsets, lengths, labels)
+
+
+class CachedTokenDataset(Dataset):
+    """
+    Unpadded examples sliced from the memory-mapped token file; padding is left to the collator.
+    """
+
+    def __init__(self, tokens, offsets, lengths, labels):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.lengths = lengths
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        offset = self.offsets[idx]
+        return {
+            "input_ids": self.tokens[offset:offset + self.lengths[idx]].tolist(),
+            "labels": int(self.labels[idx]),
+        }
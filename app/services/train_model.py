@@ -1,116 +1,108 @@
 """
 This script demonstrates an offline fine-tuning pipeline for our toxicity classifier.
-It reads training data from "training_data.json", where messages flagged by the bot and
-admin feedback (like/dislike) are stored. The script converts the feedback into labels:
+It reads training data from the append-only training log (see app/core/learning.py), where
+messages flagged by the bot and admin feedback (like/dislike) are stored; every vote is attached
+to its flag by flag_id, and each admin's latest vote counts. The script converts the votes into labels:
     - "like" means the flag was correct (user appeared intoxicated) → label 1.
     - "dislike" means the flag was incorrect (user was normal) → label 0.
+    - with several admins the majority wins; tied flags are skipped.
 The pipeline uses these labeled examples to fine-tune the model.
-A scheduled training run (e.g., nightly) followed by a bot restart will reload the model,
-gradually improving its discriminative capability.
+Each run saves the model into a new version directory and publishes it in the model manifest
+(see app/core/model_registry.py); a running bot picks the new version up and swaps it in without
+a restart, gradually improving its discriminative capability.
+
+Texts are tokenized once into a memory-mapped cache (app/services/token_cache.py) and batched
+with dynamic padding over length-grouped batches, so short chat messages are not padded to 512.
+By default a run is incremental: it continues from the current fine-tuned version and trains only
+on flags voted on after the last vote recorded in the manifest by the previous run. Use --full to
+retrain the base model on the whole log:
+    python -m app.services.train_model            # nightly, incremental
+    python -m app.services.train_model --full
 Note: In production, you might want to add further data validation, error handling,
 and use a proper machine learning pipeline.
 """
 
-import os
-import json
+import argparse
 import logging
-from datetime import datetime
 from pathlib import Path
 
-import torch
-from torch.utils.data import Dataset
-
 from transformers import (
     AutoTokenizer,
     AutoModelForSequenceClassification,
+    DataCollatorWithPadding,
     Trainer,
     TrainingArguments,
 )
 
+from app.core.learning import TRAINING_DB_FILE, iter_labeled_examples
+from app.core.model_registry import FINE_TUNED_DIR, new_version_dir, publish_version, read_manifest
+from app.services.token_cache import TokenCache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-TRAINING_DATA_FILE = "training_data.json"
-MODEL_SAVE_DIR = "app/models/fine_tuned_model"
 MODEL_NAME = "cointegrated/rubert-tiny-toxicity"
+MAX_LENGTH = 512
 
-class FeedbackDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_length=512):
-        self.texts = texts
-        self.labels = labels
-        self.tokenizer = tokenizer
-        self.max_length = max_length
-
-    def __len__(self):
-        return len(self.texts)
-
-    def __getitem__(self, idx):
-        encoding = self.tokenizer(
-            self.texts[idx],
-            truncation=True,
-            padding="max_length",
-            max_length=self.max_length,
-            return_tensors="pt",
-        )
-        item = {key: val.squeeze(0) for key, val in encoding.items()}
-        item["labels"] = torch.tensor(self.labels[idx], dtype=torch.long)
-        return item
-
-def load_training_data(filepath):
+def load_training_data(filepath, since_vote_id=0):
     """
-    Load training data from a JSON file.
-    Only messages with non-null feedback are used.
-    "like" indicates a correct flag (label 1) and "dislike" indicates an incorrect flag (label 0).
+    Load labeled flags from the training log database, optionally only those voted on after
+    `since_vote_id`. A legacy training_data.json is migrated into it on first open.
+    Returns (examples, last_vote_id), where last_vote_id is the newest vote that was read.
     """
-    if not os.path.exists(filepath):
-        logger.error(f"Training data file {filepath} does not exist.")
-        return []
-
-    with open(filepath, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     examples = []
-    for entry in data:
-        feedback = entry.get("feedback")
-        text = entry.get("text")
-        # Only use examples where a feedback is given and text exists.
-        if feedback is None or text is None:
-            continue
-        if feedback.lower() == "like":
-            label = 1
-        elif feedback.lower() == "dislike":
-            label = 0
-        else:
-            continue
-        examples.append({
-            "text": text,
-            "label": label,
-            "timestamp": entry.get("timestamp", "")
-        })
-    logger.info(f"Loaded {len(examples)} examples from training data.")
-    return examples
-
-def main():
-    examples = load_training_data(TRAINING_DATA_FILE)
+    last_vote_id = since_vote_id
+    for example in iter_labeled_examples(filepath, since_vote_id):
+        last_vote_id = max(last_vote_id, example["last_vote_id"])
+        examples.append(example)
+    logger.info(f"Loaded {len(examples)} labeled examples from training data (votes after {since_vote_id}).")
+    return examples, last_vote_id
+
+def resolve_starting_point(full: bool):
+    """
+    Return (source, parent_version, since_vote_id): the model to continue from and the vote
+    after which examples are new. A full run, or one without a published version, starts over.
+    """
+    manifest = read_manifest()
+    current = manifest.get("current")
+    if full or not current:
+        return MODEL_NAME, None, 0
+    source = str(Path(FINE_TUNED_DIR) / current)
+    if not Path(source).is_dir():
+        return MODEL_NAME, None, 0
+    since_vote_id = manifest.get("versions", {}).get(current, {}).get("last_vote_id", 0)
+    return source, current, since_vote_id
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="Retrain the base model on the whole training log")
+    parser.add_argument("--epochs", type=float, default=3)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--learning-rate", type=float, default=2e-5)
+    args = parser.parse_args(argv)
+
+    source, parent, since_vote_id = resolve_starting_point(args.full)
+    examples, last_vote_id = load_training_data(TRAINING_DB_FILE, since_vote_id)
     if not examples:
-        logger.error("No training examples available. Exiting training pipeline.")
+        logger.error("No new training examples available. Exiting training pipeline.")
         return
 
     texts = [ex["text"] for ex in examples]
     labels = [ex["label"] for ex in examples]
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=2)
-
-    dataset = FeedbackDataset(texts, labels, tokenizer)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModelForSequenceClassification.from_pretrained(source, num_labels=2)
+    dataset = TokenCache(tokenizer, MAX_LENGTH).dataset(texts, labels)
 
     training_args = TrainingArguments(
         output_dir="./results",
-        num_train_epochs=3,
-        per_device_train_batch_size=8,
-        learning_rate=2e-5,
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
         weight_decay=0.01,
+        # Batches of similar length: padding per batch stays close to the longest real message.
+        group_by_length=True,
         logging_steps=10,
         logging_dir="./logs",
         save_steps=50,
@@ -123,16 +115,27 @@ def main():
         model=model,
         args=training_args,
         train_dataset=dataset,
+        data_collator=DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8),
     )
 
-    logger.info("Starting fine-tuning process...")
+    mode = f"incremental from {parent}" if parent else f"full from {source}"
+    logger.info(f"Starting fine-tuning process ({mode}, {len(examples)} examples)...")
     trainer.train()
     logger.info("Training complete.")
 
-    Path(MODEL_SAVE_DIR).mkdir(parents=True, exist_ok=True)
-    model.save_pretrained(MODEL_SAVE_DIR)
-    tokenizer.save_pretrained(MODEL_SAVE_DIR)
-    logger.info(f"Fine-tuned model saved to {MODEL_SAVE_DIR}")
+    version, save_dir = new_version_dir()
+    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(save_dir)
+    tokenizer.save_pretrained(save_dir)
+    # Publishing only after the files are complete lets running bots hot-swap to this version.
+    publish_version(
+        version,
+        examples=len(examples),
+        base_model=MODEL_NAME,
+        parent=parent,
+        last_vote_id=last_vote_id,
+    )
+    logger.info(f"Fine-tuned model saved to {save_dir} and published as version {version}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,135 @@
+"""
+Train the hashed char-n-gram pre-filter (see app/core/prefilter.py) and report its recall loss.
+Labels come from the flags/votes index of the training log: a voted flag takes the admins'
+majority label (ties are skipped), and flags nobody voted on count as toxic. Because the log only holds flagged
+messages, pass a sample of ordinary chat traffic with --traffic (one message per line); it is
+labeled by the full transformer model (teacher labels) and provides the benign examples.
+
+    python -m app.services.train_prefilter --traffic chat_sample.txt
+    python -m app.services.train_prefilter --traffic chat_sample.txt --evaluate-only
+
+The evaluation runs the full model on a held-out split and reports, for a sweep of clear
+thresholds, the benign-skip rate (share of messages the model would not flag that the cascade
+clears) and the recall loss (share of messages the model would flag that the cascade clears).
+"""
+
+import argparse
+import logging
+import random
+import sys
+
+from app.config import Config
+from app.core.backends import load_backend
+from app.core.learning import iter_labeled_examples, iter_unvoted_flags
+from app.core.model_registry import resolve_model_source
+from app.core.nlp import TOXICITY_THRESHOLD
+from app.core.prefilter import STAGES, HashedNgramModel, Prefilter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+THRESHOLD_SWEEP = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5)
+
+
+def load_logged_examples():
+    """
+    (text, label) pairs, one per flag: the same join of flags and votes train_model uses
+    (each admin's last vote counts), plus unvoted flags labeled toxic.
+    """
+    examples = [(example["text"], example["label"]) for example in iter_labeled_examples()]
+    examples.extend((text, 1) for _, text in iter_unvoted_flags())
+    return examples
+
+
+def load_traffic(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def score_with_model(texts, batch_size=32):
+    backend, tokenizer = load_backend(Config.NLP_BACKEND, resolve_model_source()[0])
+    scores = []
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(
+            texts[i:i + batch_size],
+            return_tensors=backend.tensor_type,
+            truncation=True,
+            max_length=512,
+            padding=True,
+        )
+        scores.extend(backend.scores(inputs))
+    return scores
+
+
+def evaluate(prefilter: Prefilter, texts, model_flags) -> dict:
+    """
+    Compare the cascade against full-model decisions for each threshold in THRESHOLD_SWEEP.
+    """
+    report = {"samples": len(texts), "model_flagged": sum(model_flags), "thresholds": {}}
+    for threshold in THRESHOLD_SWEEP:
+        prefilter.clear_threshold = threshold
+        stages = dict.fromkeys(STAGES, 0)
+        cleared_benign = cleared_toxic = 0
+        for text, flagged in zip(texts, model_flags):
+            cleared, stage = prefilter.route(text)
+            stages[stage] += 1
+            if cleared and flagged:
+                cleared_toxic += 1
+            elif cleared:
+                cleared_benign += 1
+        benign = len(texts) - sum(model_flags)
+        report["thresholds"][threshold] = {
+            "benign_skip_rate": cleared_benign / benign if benign else 0.0,
+            "recall_loss": cleared_toxic / sum(model_flags) if any(model_flags) else 0.0,
+            "stage_fractions": {stage: count / len(texts) for stage, count in stages.items()},
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=None, help="Text file with ordinary chat messages, one per line")
+    parser.add_argument("--output", default=Config.PREFILTER_MODEL_PATH)
+    parser.add_argument("--eval-fraction", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--evaluate-only", action="store_true", help="Evaluate the saved model without retraining")
+    args = parser.parse_args(argv)
+
+    examples = load_logged_examples()
+    if args.traffic:
+        traffic = load_traffic(args.traffic)
+        scores = score_with_model(traffic)
+        examples.extend((text, int(score >= TOXICITY_THRESHOLD)) for text, score in zip(traffic, scores))
+    else:
+        logger.warning("No --traffic sample given: benign examples come only from disliked flags.")
+    if not examples:
+        logger.error("No examples available. Exiting.")
+        return 1
+
+    random.Random(0).shuffle(examples)
+    split = int(len(examples) * (1 - args.eval_fraction))
+    train, held_out = examples[:split], examples[split:]
+
+    if args.evaluate_only:
+        model = HashedNgramModel.load(args.output)
+    else:
+        model = HashedNgramModel.train([t for t, _ in train], [y for _, y in train], epochs=args.epochs)
+        model.save(args.output)
+        logger.info(f"Pre-filter model trained on {len(train)} examples and saved to {args.output}")
+
+    if held_out:
+        texts = [t for t, _ in held_out]
+        model_flags = [score >= TOXICITY_THRESHOLD for score in score_with_model(texts)]
+        report = evaluate(Prefilter(linear_model=model), texts, model_flags)
+        logger.info(f"Held-out samples: {report['samples']}, flagged by the full model: {report['model_flagged']}")
+        for threshold, row in report["thresholds"].items():
+            logger.info(
+                f"threshold={threshold}: benign_skip_rate={row['benign_skip_rate']:.3f} "
+                f"recall_loss={row['recall_loss']:.3f} stages={row['stage_fractions']}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# расположен в: police-bot-prod/app/services/verdict_cache.py
+
+import hashlib
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from app.config import Config
+from app.services import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedVerdict(NamedTuple):
+    needs_test: bool
+    score: Optional[float] = None
+    # Окно длинного сообщения, решившее вердикт (None – записи старого формата).
+    window: Optional[int] = None
+
+    def encode(self) -> str:
+        score = "" if self.score is None else f"{self.score:.6f}"
+        window = "" if self.window is None else str(self.window)
+        return f"{int(self.needs_test)}|{score}|{window}"
+
+    @classmethod
+    def decode(cls, value: str) -> "CachedVerdict":
+        # Старые записи в Redis – просто "1" или "0".
+        needs_test, _, rest = value.partition("|")
+        score, _, window = rest.partition("|")
+        return cls(needs_test == "1", float(score) if score else None, int(window) if window else None)
+
+
+class VerdictCache:
+    """
+    Двухуровневый кэш вердиктов модели: локальный LRU с TTL внутри процесса и Redis за ним.
+    Ключ – хэш нормализованного текста и версии модели, поэтому после смены модели
+    старые вердикты просто перестают находиться.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None, redis_ttl: int = None):
+        self.max_size = max_size if max_size is not None else Config.VERDICT_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else Config.VERDICT_CACHE_TTL
+        self.redis_ttl = redis_ttl if redis_ttl is not None else Config.VERDICT_CACHE_REDIS_TTL
+        # key -> (expires_at, CachedVerdict); порядок элементов – порядок последнего обращения.
+        self._local = OrderedDict()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.evictions_size = 0
+        self.evictions_ttl = 0
+
+    @staticmethod
+    def make_key(text: str, model_version: str) -> str:
+        # Регистр не трогаем: модель к нему чувствительна. Схлопываем пробелы и юникод-варианты.
+        normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+        digest = hashlib.sha1(f"{model_version}\0{normalized}".encode("utf-8")).hexdigest()
+        return f"verdict:{digest}"
+
+    async def get(self, key: str) -> Optional[CachedVerdict]:
+        entry = self._local.get(key)
+        if entry is not None:
+            expires_at, verdict = entry
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                self.hits_local += 1
+                return verdict
+            del self._local[key]
+            self.evictions_ttl += 1
+
+        try:
+            value = await cache.get_cache(key)
+        except Exception as ex:
+            logger.debug(f"Redis недоступен для кэша вердиктов: {ex}")
+            value = None
+        if value is not None:
+            verdict = CachedVerdict.decode(value)
+            self._remember(key, verdict)
+            self.hits_redis += 1
+            return verdict
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, verdict: CachedVerdict) -> None:
+        self._remember(key, verdict)
+        try:
+            await cache.set_cache(key, verdict.encode(), expire=self.redis_ttl)
+        except Exception as ex:
+            logger.debug(f"Не удалось сохранить вердикт в Redis: {ex}")
+
+    def _remember(self, key: str, verdict: CachedVerdict) -> None:
+        self._local[key] = (time.monotonic() + self.ttl, verdict)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+            self.evictions_size += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._local),
+            "max_size": self.max_size,
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "evictions_size": self.evictions_size,
+            "evictions_ttl": self.evictions_ttl,
+        }
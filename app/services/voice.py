@@ -0,0 +1,196 @@
+# расположен в: police-bot-prod/app/services/voice.py
+
+import abc
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2  # PCM int16 mono
+
+
+def decode_to_pcm(data: bytes, sample_rate: int = SAMPLE_RATE, max_duration: float = None) -> bytes:
+    """
+    Декодирует OGG/Opus в PCM int16 mono с заданной частотой (ресемплинг через librosa).
+    Выполняется в отдельном процессе, поэтому импорты тяжелых библиотек – внутри.
+    """
+    import librosa
+    import numpy as np
+
+    try:
+        # libsndfile читает OGG/Opus прямо из памяти.
+        samples, _ = librosa.load(io.BytesIO(data), sr=sample_rate, mono=True, duration=max_duration)
+    except Exception:
+        # Старые сборки libsndfile не знают Opus: librosa уходит в audioread/ffmpeg, ему нужен файл.
+        with tempfile.NamedTemporaryFile(suffix=".ogg") as f:
+            f.write(data)
+            f.flush()
+            samples, _ = librosa.load(f.name, sr=sample_rate, mono=True, duration=max_duration)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+
+class SpeechEngine(abc.ABC):
+    """
+    Интерфейс локального движка распознавания речи. Поток распознавания получает PCM
+    кусками: accept() возвращает текст очередного завершенного фрагмента (или None),
+    finish() – остаток.
+    """
+
+    @abc.abstractmethod
+    def create_stream(self):
+        ...
+
+
+class VoskEngine(SpeechEngine):
+    """
+    Офлайн-распознавание на Vosk (Kaldi). Модель загружается один раз и разделяется потоками.
+    """
+
+    def __init__(self, model_path: str):
+        from vosk import Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+
+    def create_stream(self):
+        from vosk import KaldiRecognizer
+
+        return _VoskStream(KaldiRecognizer(self.model, SAMPLE_RATE))
+
+
+class _VoskStream:
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+
+    def accept(self, chunk: bytes) -> Optional[str]:
+        if self.recognizer.AcceptWaveform(chunk):
+            return json.loads(self.recognizer.Result()).get("text") or None
+        return None
+
+    def finish(self) -> Optional[str]:
+        return json.loads(self.recognizer.FinalResult()).get("text") or None
+
+
+ENGINES = {
+    "vosk": VoskEngine,
+}
+
+
+def engine_available() -> bool:
+    """
+    Проверка настроек без загрузки модели: движок известен и модель лежит по STT_MODEL_PATH.
+    """
+    if Config.STT_ENGINE in ("", "none"):
+        return False
+    if Config.STT_ENGINE not in ENGINES:
+        logger.error(f"Неизвестный STT_ENGINE={Config.STT_ENGINE!r}; распознавание голоса отключено.")
+        return False
+    if not os.path.exists(Config.STT_MODEL_PATH):
+        logger.warning(
+            f"Модель распознавания речи не найдена по пути {Config.STT_MODEL_PATH} (STT_MODEL_PATH); "
+            f"распознавание голоса отключено. Образ Docker скачивает ее при сборке, см. Dockerfile."
+        )
+        return False
+    return True
+
+
+def create_engine() -> Optional[SpeechEngine]:
+    if not engine_available():
+        return None
+    try:
+        return ENGINES[Config.STT_ENGINE](Config.STT_MODEL_PATH)
+    except Exception as ex:
+        logger.error(f"Не удалось загрузить движок распознавания речи: {ex}")
+        return None
+
+
+class VoicePipeline:
+    """
+    Офлайн-конвейер голосовых сообщений: проверка лимитов до скачивания, декодирование
+    и ресемплинг в пуле процессов, потоковое распознавание кусками в собственном пуле потоков.
+    Ни один из этапов не выполняется в event loop и не делит пул с инференсом текста.
+    Модель STT загружается в пуле потоков при первом голосовом сообщении, а не при старте бота.
+    """
+
+    def __init__(self, engine: SpeechEngine = None):
+        self.engine = engine
+        # До загрузки известно только, что движок настроен и модель на месте.
+        self._available = engine is not None or engine_available()
+        self._engine_lock = None
+        self.chunk_bytes = int(Config.VOICE_CHUNK_SECONDS * SAMPLE_RATE) * BYTES_PER_SAMPLE
+        self._decode_pool = None
+        self._stt_pool = ThreadPoolExecutor(max_workers=Config.STT_THREADS, thread_name_prefix="stt")
+
+    @property
+    def enabled(self) -> bool:
+        return self._available
+
+    async def _ensure_engine(self) -> SpeechEngine:
+        if self.engine is not None:
+            return self.engine
+        if self._engine_lock is None:
+            self._engine_lock = asyncio.Lock()
+        async with self._engine_lock:
+            if self.engine is None and self._available:
+                loop = asyncio.get_running_loop()
+                self.engine = await loop.run_in_executor(self._stt_pool, create_engine)
+                # Модель не загрузилась – голосовые дальше не скачиваются зря.
+                self._available = self.engine is not None
+        if self.engine is None:
+            raise RuntimeError("Распознавание речи недоступно")
+        return self.engine
+
+    def check_limits(self, voice) -> Optional[str]:
+        """
+        Возвращает причину отказа, если сообщение слишком длинное или тяжелое для обработки.
+        """
+        if voice.duration and voice.duration > Config.VOICE_MAX_DURATION:
+            return f"длительность {voice.duration} с больше {Config.VOICE_MAX_DURATION} с"
+        if voice.file_size and voice.file_size > Config.VOICE_MAX_BYTES:
+            return f"размер {voice.file_size} байт больше {Config.VOICE_MAX_BYTES} байт"
+        return None
+
+    async def decode(self, data) -> bytes:
+        if len(data) > Config.VOICE_MAX_BYTES:
+            raise ValueError(f"Голосовое сообщение больше {Config.VOICE_MAX_BYTES} байт")
+        if self._decode_pool is None:
+            # spawn: дочерние процессы не наследуют потоки torch и event loop родителя.
+            self._decode_pool = ProcessPoolExecutor(
+                max_workers=Config.VOICE_DECODE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._decode_pool, decode_to_pcm, bytes(data), SAMPLE_RATE, Config.VOICE_MAX_DURATION
+        )
+
+    async def segments(self, pcm: bytes):
+        """
+        Асинхронно отдает распознанные фрагменты по мере их появления.
+        """
+        engine = await self._ensure_engine()
+        loop = asyncio.get_running_loop()
+        stream = engine.create_stream()
+        for offset in range(0, len(pcm), self.chunk_bytes):
+            segment = await loop.run_in_executor(self._stt_pool, stream.accept, pcm[offset:offset + self.chunk_bytes])
+            if segment:
+                yield segment
+        segment = await loop.run_in_executor(self._stt_pool, stream.finish)
+        if segment:
+            yield segment
+
+    async def close(self) -> None:
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False, cancel_futures=True)
+            self._decode_pool = None
+        self._stt_pool.shutdown(wait=False, cancel_futures=True)
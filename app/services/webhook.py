@@ -0,0 +1,72 @@
+# расположен в: police-bot-prod/app/services/webhook.py
+
+import logging
+import time
+from collections import OrderedDict
+
+from telegram import Update
+
+from app.config import Config
+from app.services import cache, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Окно дедупликации update_id: Telegram повторяет доставку, если не дождался ответа,
+    и повтор может попасть в другой воркер. Основная проверка – SET NX в Redis (общая для всех
+    воркеров), при недоступности Redis – локальное окно в памяти процесса.
+    """
+
+    def __init__(self, window_seconds: float = None, max_local: int = 100000):
+        self.window_seconds = window_seconds if window_seconds is not None else Config.UPDATE_DEDUP_WINDOW
+        self.max_local = max_local
+        self._seen = OrderedDict()  # update_id -> время первой доставки
+
+    def _first_seen_locally(self, update_id: int) -> bool:
+        now = time.monotonic()
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window_seconds and len(self._seen) < self.max_local:
+                break
+            del self._seen[oldest_id]
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = now
+        return True
+
+    async def first_seen(self, update_id: int) -> bool:
+        first = self._first_seen_locally(update_id)
+        if first and cache.redis_client is not None:
+            try:
+                first = bool(await cache.redis_client.set(
+                    f"police:update:{update_id}", "1", nx=True, ex=int(self.window_seconds)
+                ))
+            except Exception as ex:
+                logger.debug(f"Redis недоступен для дедупликации обновлений: {ex}")
+        if not first:
+            metrics.WEBHOOK_DUPLICATES.inc()
+        return first
+
+
+async def register_webhook(telegram_app) -> None:
+    """
+    Регистрирует webhook в Telegram. Вызов идемпотентен, но при нескольких воркерах
+    его делает только тот, кто первым возьмет короткую блокировку в Redis.
+    """
+    if cache.redis_client is not None:
+        try:
+            if not await cache.redis_client.set("police:webhook:registering", "1", nx=True, ex=60):
+                return
+        except Exception as ex:
+            logger.debug(f"Redis недоступен для блокировки регистрации webhook: {ex}")
+    url = Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH
+    await telegram_app.bot.set_webhook(
+        url=url,
+        secret_token=Config.WEBHOOK_SECRET or None,
+        max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+        # chat_member не приходят без явного allowed_updates, а по ним сбрасывается кэш участников
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logger.info(f"Webhook зарегистрирован: {url}")
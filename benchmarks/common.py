@@ -0,0 +1,85 @@
+"""
+Shared helpers for the benchmark scripts: isolated side effects, workload generation and reporting.
+"""
+
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+WORDS = (
+    "привет как дела сегодня завтра вчера хорошо плохо работа дом машина погода дождь солнце "
+    "встреча время минута час день неделя чат бот сообщение ссылка фото видео документ вопрос "
+    "ответ спасибо пожалуйста конечно может быть давай пойдем смотри слушай кстати вообще "
+    "очень просто нормально отлично идея проект задача код сервер база данных релиз"
+).split()
+
+
+def isolate_side_effects() -> str:
+    """
+    Point the training log at a throw-away directory so benchmarks never touch (or migrate)
+    the real training data. Returns the directory.
+    """
+    from app.core import learning
+
+    workdir = tempfile.mkdtemp(prefix="police-bench-")
+    learning.TRAINING_DB_FILE = os.path.join(workdir, "training_data.db")
+    learning.TRAINING_DATA_FILE = os.path.join(workdir, "training_data.json")
+    return workdir
+
+
+def message_length(rng: random.Random, median: int = 40, sigma: float = 1.0, limit: int = 4096) -> int:
+    # Chat message lengths are roughly log-normal: mostly short replies with a long tail of pastes.
+    return max(1, min(limit, int(rng.lognormvariate(math.log(median), sigma))))
+
+
+def make_text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def percentiles(samples, points=(50, 95, 99)) -> dict:
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def rss_mb() -> dict:
+    current = None
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {"rss_mb": current, "peak_rss_mb": peak}
+
+
+def write_report(report: dict, path: str) -> None:
+    report.setdefault("meta", {}).update({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "argv": sys.argv,
+    })
+    if path == "-":
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,216 @@
+"""
+Minimal stand-ins for the Telegram objects PoliceBot touches, so handlers can be driven
+offline. The fake bot records every API call instead of talking to Telegram.
+"""
+
+import asyncio
+import datetime
+import itertools
+import time
+
+
+class RecordingBot:
+    def __init__(self, api_latency_ms: float = 0.0):
+        self.api_latency = api_latency_ms / 1000.0
+        self.calls = []
+        # (chat_id, user_id) reported as chat administrators; everyone else is a plain member.
+        self.admins = set()
+
+    async def _call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def get_file(self, file_id):
+        await self._call("get_file", file_id=file_id)
+        return FakeFile(self)
+
+    async def get_chat(self, chat_id):
+        await self._call("get_chat", chat_id=chat_id)
+        return FakeChat(chat_id, "supergroup")
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._call("get_chat_member", chat_id=chat_id, user_id=user_id)
+        return FakeChatMember("administrator" if (chat_id, user_id) in self.admins else "member")
+
+    async def restrict_chat_member(self, **kwargs):
+        await self._call("restrict_chat_member", **kwargs)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("send_message", chat_id=chat_id, text=text, **kwargs)
+
+    def count(self, method: str) -> int:
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+class FakeFile:
+    def __init__(self, bot, payload: bytes = b"\0" * 16000):
+        self.bot = bot
+        self.payload = payload
+
+    async def download_as_bytearray(self):
+        await self.bot._call("download_file")
+        return bytearray(self.payload)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id, chat_type="supergroup"):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class FakeChatMember:
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeVoice:
+    def __init__(self, file_id, duration=3, file_size=16000):
+        self.file_id = file_id
+        self.duration = duration
+        self.file_size = file_size
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, bot, chat, user, text=None, voice=None, reply_to_message=None, date=None):
+        self.message_id = next(self._ids)
+        self.bot = bot
+        self.chat = chat
+        self.from_user = user
+        self.text = text
+        self.voice = voice
+        self.reply_to_message = reply_to_message
+        self.date = date or datetime.datetime.now(datetime.timezone.utc)
+
+    async def reply_text(self, text, **kwargs):
+        await self.bot._call("send_message", chat_id=self.chat.id, text=text, **kwargs)
+        return FakeMessage(self.bot, self.chat, None, text=text, reply_to_message=self)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot, user, data, message):
+        self.bot = bot
+        self.from_user = user
+        self.data = data
+        self.message = message
+
+    async def answer(self, text=None, show_alert=False):
+        await self.bot._call("answer_callback_query", text=text)
+
+
+class FakeUpdate:
+    _ids = itertools.count(1)
+
+    def __init__(self, message=None, callback_query=None):
+        self.update_id = next(self._ids)
+        self.callback_query = callback_query
+        self.effective_message = message if message is not None else (callback_query and callback_query.message)
+        if message is not None:
+            self.effective_user = message.from_user
+            self.effective_chat = message.chat
+        else:
+            self.effective_user = callback_query.from_user
+            self.effective_chat = callback_query.message.chat if callback_query.message else None
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.error = None
+
+
+def text_update(bot, chat_id, user_id, text):
+    return FakeUpdate(FakeMessage(bot, FakeChat(chat_id), FakeUser(user_id), text=text))
+
+
+def voice_update(bot, chat_id, user_id, duration=3):
+    voice = FakeVoice(f"voice-{time.monotonic_ns()}", duration=duration)
+    return FakeUpdate(FakeMessage(bot, FakeChat(chat_id), FakeUser(user_id), voice=voice))
+
+
+def feedback_update(bot, chat_id, admin_id, data, flagged_text):
+    # Only administrators may vote on flags, so the clicking user is made one.
+    bot.admins.add((chat_id, admin_id))
+    flagged = FakeMessage(bot, FakeChat(chat_id), FakeUser(admin_id + 1), text=flagged_text)
+    warning = FakeMessage(bot, FakeChat(chat_id), None, text="warning", reply_to_message=flagged)
+    return FakeUpdate(callback_query=FakeCallbackQuery(bot, FakeUser(admin_id), data, warning))
+
+
+class FakeVoicePipeline:
+    """
+    Voice pipeline stand-in: decoding and speech recognition cost fixed (async) time and the
+    transcript arrives in a few segments, like the real streaming recognizer.
+    """
+    enabled = True
+
+    def __init__(self, decode_ms: float = 20.0, segment_ms: float = 30.0, segments=3):
+        self.decode_seconds = decode_ms / 1000.0
+        self.segment_seconds = segment_ms / 1000.0
+        self.segment_count = segments
+
+    def check_limits(self, voice):
+        return None
+
+    async def decode(self, data):
+        await asyncio.sleep(self.decode_seconds)
+        return bytes(data)
+
+    async def segments(self, pcm):
+        for i in range(self.segment_count):
+            await asyncio.sleep(self.segment_seconds)
+            yield f"фрагмент номер {i} голосового сообщения"
+
+    async def close(self):
+        pass
+
+
+class FakeTokenizer:
+    """
+    Tokenizer stand-in for --fake-model runs: about four characters per token, overlapping
+    windows like a fast tokenizer, and pad() returns only what FakeBackend needs.
+    """
+    is_fast = True
+
+    def __call__(self, texts, max_length=512, stride=0, return_overflowing_tokens=False, **kwargs):
+        input_ids, sample_of_row = [], []
+        for sample, text in enumerate(texts):
+            length = len(text) // 4 + 2
+            start = 0
+            while True:
+                input_ids.append([0] * min(length - start, max_length))
+                sample_of_row.append(sample)
+                if not return_overflowing_tokens or start + max_length >= length:
+                    break
+                start += max_length - stride
+        encoded = {"input_ids": input_ids}
+        if return_overflowing_tokens:
+            encoded["overflow_to_sample_mapping"] = sample_of_row
+        return encoded
+
+    def pad(self, features, return_tensors=None):
+        return {"lengths": [len(feature["input_ids"]) for feature in features]}
+
+
+class FakeBackend:
+    """
+    Backend stand-in whose forward pass costs a fixed time plus a per-token term.
+    Scores are a deterministic function of the input length, around 5% of texts flag.
+    """
+    tensor_type = "np"
+    name = "fake"
+
+    def __init__(self, batch_ms: float = 5.0, per_token_us: float = 20.0):
+        self.batch_seconds = batch_ms / 1000.0
+        self.per_token_seconds = per_token_us / 1e6
+
+    def scores(self, inputs):
+        lengths = inputs["lengths"]
+        time.sleep(self.batch_seconds + self.per_token_seconds * max(lengths) * len(lengths))
+        return [0.9 if length % 20 == 0 else 0.1 for length in lengths]
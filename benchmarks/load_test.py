@@ -0,0 +1,177 @@
+"""
+Replay synthetic Telegram traffic through PoliceBot handlers and report throughput and latency.
+
+    python -m benchmarks.load_test --messages 5000 --concurrency 64 --output load.json
+    python -m benchmarks.load_test --fake-model --model-batch-ms 5   # bot overhead without the model
+
+Traffic mix: text messages with log-normal lengths, a share of voice notes and of admin feedback
+clicks; users who received a test answer it with their next message. Telegram is replaced by a
+recording stub (see benchmarks/fakes.py), so no network access is needed.
+Updates go through the admission stage like in the bot, so with few chats the per-chat cooldown
+sheds much of the traffic: latencies are computed over admitted updates only, and the report
+counts admitted and shed ones. --no-admission sends every update to its handler (raw throughput).
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import isolate_side_effects, make_text, message_length, percentiles, rss_mb, write_report
+from benchmarks.fakes import (
+    FakeBackend,
+    FakeContext,
+    FakeTokenizer,
+    FakeVoicePipeline,
+    RecordingBot,
+    feedback_update,
+    text_update,
+    voice_update,
+)
+
+
+def build_workload(args, bot_stub, rng):
+    workload = []
+    for _ in range(args.messages):
+        chat_id = -1000000000000 - rng.randrange(args.chats)
+        user_id = rng.randrange(1, args.users + 1)
+        roll = rng.random()
+        if roll < args.voice_share:
+            workload.append(("handle_voice", voice_update(bot_stub, chat_id, user_id)))
+        elif roll < args.voice_share + args.feedback_share:
+            data = f"{rng.choice(('like', 'dislike'))}|{rng.getrandbits(128):032x}"
+            text = make_text(rng, message_length(rng, args.median_length))
+            workload.append(("handle_feedback_callback", feedback_update(bot_stub, chat_id, user_id, data, text)))
+        else:
+            text = make_text(rng, message_length(rng, args.median_length))
+            workload.append(("handle_text", text_update(bot_stub, chat_id, user_id, text)))
+    return workload
+
+
+async def run(args) -> dict:
+    isolate_side_effects()
+    from app.core.bot import PoliceBot
+    from app.core.nlp import ModelHandle
+    from app.services import metrics
+    from app.services.outbound import OutboundScheduler
+
+    def admission_counts():
+        return {
+            sample.labels["decision"]: sample.value
+            for sample in metrics.ADMISSION.collect()[0].samples if sample.name.endswith("_total")
+        }
+
+    rng = random.Random(args.seed)
+    bot_stub = RecordingBot(api_latency_ms=args.api_latency_ms)
+    context = FakeContext(bot_stub)
+    bot = PoliceBot()
+    if not args.real_voice:
+        bot.voice = FakeVoicePipeline(args.voice_decode_ms, args.voice_segment_ms)
+    # По умолчанию лимиты Telegram выключены: меряем накладные расходы бота, а не ожидание токенов.
+    bot.outbound = OutboundScheduler(global_rate=args.outbound_global_rate, chat_rate=args.outbound_chat_rate)
+
+    load_started = time.perf_counter()
+    if args.fake_model:
+        bot.nlp.active = ModelHandle("fake", FakeBackend(args.model_batch_ms, args.model_token_us), FakeTokenizer())
+        bot.nlp._loaded_event().set()
+    else:
+        await bot.nlp.load()
+    model_load_seconds = time.perf_counter() - load_started
+    rss_before = rss_mb()
+
+    workload = build_workload(args, bot_stub, rng)
+    latencies = {}
+    shed = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    decisions_before = admission_counts()
+
+    async def drive(handler_name, update):
+        async with semaphore:
+            start = time.perf_counter()
+            handler = getattr(bot, handler_name)
+            admitted = True
+
+            # Same order as bot.serialized(bot.admitted(...)), but the decision is visible here.
+            async def admit_and_handle(update, context):
+                nonlocal admitted
+                if (not args.no_admission and handler_name != "handle_feedback_callback"
+                        and not await bot.admission.admit(update)):
+                    admitted = False
+                    return
+                await handler(update, context)
+
+            admit_and_handle.__name__ = handler_name
+            try:
+                await bot.serialized(admit_and_handle)(update, context)
+            finally:
+                if admitted:
+                    latencies.setdefault(handler_name, []).append(time.perf_counter() - start)
+                else:
+                    shed[handler_name] = shed.get(handler_name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(name, update) for name, update in workload))
+    elapsed = time.perf_counter() - started
+    await bot.nlp.close()
+    await bot.voice.close()
+    await bot.outbound.close()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    decisions_after = admission_counts()
+    return {
+        "config": vars(args),
+        "model_load_seconds": model_load_seconds,
+        "elapsed_seconds": elapsed,
+        "messages_per_second": len(workload) / elapsed if elapsed else None,
+        "admitted_per_second": len(all_latencies) / elapsed if elapsed else None,
+        "admission": {
+            "admitted": len(all_latencies),
+            "shed": sum(shed.values()),
+            "shed_by_handler": shed,
+            "decisions": {
+                decision: count - decisions_before.get(decision, 0.0)
+                for decision, count in decisions_after.items()
+            },
+        },
+        # Over admitted updates only: shed ones return before reaching a handler.
+        "latency_seconds": {"all": percentiles(all_latencies)} | {
+            name: dict(percentiles(values), count=len(values)) for name, values in latencies.items()
+        },
+        "telegram_calls": {
+            method: bot_stub.count(method)
+            for method in ("send_message", "get_chat", "get_chat_member", "restrict_chat_member", "get_file")
+        },
+        "update_queues": bot.updates.stats(top=3),
+        "outbound": bot.outbound.stats(),
+        "chat_info_cache": bot.chat_info.stats(),
+        "memory": {"before": rss_before, "after": rss_mb()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--median-length", type=int, default=40)
+    parser.add_argument("--voice-share", type=float, default=0.05)
+    parser.add_argument("--feedback-share", type=float, default=0.02)
+    parser.add_argument("--api-latency-ms", type=float, default=30.0, help="Simulated Telegram API round-trip")
+    parser.add_argument("--fake-model", action="store_true", help="Replace the transformer with a timed stub")
+    parser.add_argument("--model-batch-ms", type=float, default=5.0)
+    parser.add_argument("--model-token-us", type=float, default=20.0)
+    parser.add_argument("--real-voice", action="store_true", help="Use the configured STT engine instead of a stub")
+    parser.add_argument("--voice-decode-ms", type=float, default=20.0)
+    parser.add_argument("--voice-segment-ms", type=float, default=30.0)
+    parser.add_argument("--outbound-global-rate", type=float, default=0.0, help="Messages/s per bot (0: unlimited)")
+    parser.add_argument("--outbound-chat-rate", type=float, default=0.0, help="Messages/s per chat (0: unlimited)")
+    parser.add_argument("--no-admission", action="store_true", help="Skip the admission stage (raw throughput)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON report path ('-' for stdout)")
+    args = parser.parse_args(argv)
+    write_report(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Microbenchmarks for the hot paths of the bot.
+
+    python -m benchmarks.micro analyze --batch-sizes 1 4 16 --lengths 16 128 512
+    python -m benchmarks.micro training-log --sizes 1000 10000 100000
+    python -m benchmarks.micro similarity
+    python -m benchmarks.micro all --output micro.json
+
+analyze       forward pass time of the served model per batch size and text length (in tokens),
+              plus end-to-end analyze() throughput through the micro-batcher.
+training-log  enqueue cost of _append_training_data and writer throughput as the log grows.
+similarity    cost of scoring a sobriety-test answer against the expected tongue twister
+              (the bot's AnswerMatcher, with the former difflib ratio as a baseline).
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import timeit
+
+from benchmarks.common import isolate_side_effects, make_text, percentiles, rss_mb, write_report
+
+
+def bench_analyze(args) -> dict:
+    from app.core.nlp import NLPProcessor
+
+    nlp = NLPProcessor()
+    rng = random.Random(args.seed)
+
+    async def load_and_measure():
+        await nlp.load()
+        results = {"model_version": nlp.model_version, "forward": []}
+        handle = nlp.active
+        for tokens in args.lengths:
+            # Roughly 4 characters per subword token for Russian chat text.
+            text = make_text(rng, tokens * 4)
+            for batch_size in args.batch_sizes:
+                texts = [text] * batch_size
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    nlp._run(handle, texts)
+                    timings.append(time.perf_counter() - start)
+                results["forward"].append({
+                    "tokens": tokens,
+                    "batch_size": batch_size,
+                    "seconds_per_batch": percentiles(timings),
+                    "ms_per_text_p50": 1000 * percentiles(timings)["p50"] / batch_size,
+                })
+
+        texts = [make_text(rng, 160) for _ in range(args.concurrent_calls)]
+        start = time.perf_counter()
+        await asyncio.gather(*(nlp.analyze(text) for text in texts))
+        elapsed = time.perf_counter() - start
+        results["analyze_concurrent"] = {
+            "calls": len(texts),
+            "seconds": elapsed,
+            "calls_per_second": len(texts) / elapsed,
+        }
+        await nlp.close()
+        return results
+
+    results = asyncio.run(load_and_measure())
+    results["memory"] = rss_mb()
+    return results
+
+
+def bench_training_log(args) -> dict:
+    isolate_side_effects()
+    from app.core import learning
+
+    rng = random.Random(args.seed)
+    results = []
+    log = learning._get_training_log()
+    written = 0
+    for size in sorted(args.sizes):
+        # Grow the log up to `size` rows, then time a fixed probe of appends at that size.
+        while written < size:
+            learning._append_training_data({"timestamp": "", "user_id": 1, "chat_id": 1,
+                                            "text": make_text(rng, 60), "feedback": None})
+            written += 1
+            # Stay under the writer's queue bound (TRAINING_LOG_MAX_QUEUE) so no row is dropped.
+            if written % 1000 == 0:
+                log.flush()
+        log.flush()
+        probe = [{"timestamp": "", "user_id": 2, "chat_id": 2, "text": make_text(rng, 60), "feedback": None}
+                 for _ in range(args.probe)]
+        start = time.perf_counter()
+        for entry in probe:
+            learning._append_training_data(entry)
+        enqueued = time.perf_counter()
+        log.flush()
+        flushed = time.perf_counter()
+        written += args.probe
+        results.append({
+            "log_rows": size,
+            "enqueue_us_per_entry": 1e6 * (enqueued - start) / args.probe,
+            "write_entries_per_second": args.probe / (flushed - start),
+        })
+    learning.close_training_log()
+    return {"points": results}
+
+
+def bench_similarity(args) -> dict:
+    import difflib
+
+    from app.core.bot import SIMILARITY_THRESHOLD, TONGUE_TWISTERS
+    from app.core.matching import AnswerMatcher
+
+    rng = random.Random(args.seed)
+    expected = TONGUE_TWISTERS[0]
+    matcher = AnswerMatcher(TONGUE_TWISTERS, SIMILARITY_THRESHOLD)
+    checks = {
+        "matcher": lambda answer: matcher.matches(answer, expected),
+        "difflib_baseline": lambda answer: difflib.SequenceMatcher(None, answer.lower(), expected.lower()).ratio(),
+    }
+
+    cases = {
+        "exact": expected,
+        "typo": expected.replace("а", "о", 2),
+        "unrelated_short": make_text(rng, len(expected)),
+        "long_paste_1k": make_text(rng, 1000),
+        "long_paste_4k": make_text(rng, 4096),
+    }
+    results = {}
+    number = max(1, args.repeat * 10)
+    for name, answer in cases.items():
+        results[name] = {"answer_length": len(answer)}
+        for check_name, check in checks.items():
+            seconds = timeit.timeit(lambda: check(answer), number=number)
+            results[name][f"{check_name}_us_per_check"] = 1e6 * seconds / number
+    return results
+
+
+BENCHMARKS = {
+    "analyze": bench_analyze,
+    "training-log": bench_training_log,
+    "similarity": bench_similarity,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=list(BENCHMARKS) + ["all"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[16, 64, 128, 256, 512])
+    parser.add_argument("--concurrent-calls", type=int, default=256)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probe", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON report path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    names = list(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    report = {"config": vars(args)}
+    for name in names:
+        report[name] = BENCHMARKS[name](args)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
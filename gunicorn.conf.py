@@ -0,0 +1,22 @@
+# расположен в корне: police-bot-prod/gunicorn.conf.py
+
+# Gunicorn подхватывает этот файл сам (запуск из корня проекта, см. Dockerfile).
+# Хуки нужны режиму нескольких воркеров с общими метриками (PROMETHEUS_MULTIPROC_DIR).
+
+import glob
+import os
+
+
+def on_starting(server):
+    # Файлы метрик прошлого запуска дали бы завышенные счетчики.
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)